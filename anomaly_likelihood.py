@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import math
+from collections import deque
+import numpy as np
+try:
+    from scipy.special import erfc as _erfc
+except ImportError:
+    _erfc = np.frompyfunc(math.erfc, 1, 1)
+
+"""
+    NAME
+      anomaly_likelihood.py
+
+    DESCRIPTION
+      Anomaly likelihood of a whole array of raw anomaly scores at once.
+
+    NOTES
+      Gives the likelihoods nupic's AnomalyLikelihood.anomalyProbability
+      returns record by record:
+
+      - the first learning_period + estimation_samples records get 0.5;
+      - then the raw scores are averaged over averaging_window records
+        and scored by the tail probability of a normal distribution,
+        estimated from the averages of the last historic_window records
+        (leaving out the first learning_period records), first on the
+        first scored record and again every reestimation_period records;
+      - a tail probability at or below the red threshold right after
+        another one is raised to the yellow threshold.
+
+      Between two estimates the distribution is fixed, so each stretch of
+      records is scored with a few array operations; only the estimates
+      loop, one per reestimation_period records. The moving averages are
+      windowed sums instead of nupic's running total, so the results
+      match it up to rounding.
+
+      StreamingLikelihood is the same computation done the way nupic does
+      it, record by record with a running total, and needs no nupic. The
+      __main__ check compares anomaly_likelihoods with it, and with nupic
+      itself when asked to.
+
+"""
+
+"""Global Variables"""
+LEARNING_PERIOD = 288
+ESTIMATION_SAMPLES = 100
+HISTORIC_WINDOW = 8640
+REESTIMATION_PERIOD = 100
+AVERAGING_WINDOW = 10
+""" Tail probabilities of the likelihood filter, as nupic computes them """
+RED_THRESHOLD = 1.0 - 0.99999
+YELLOW_THRESHOLD = 1.0 - 0.999
+""" Distribution used when the metric barely varies """
+NULL_MEAN = 0.5
+NULL_STDEV = 1e3
+MIN_VARIANCE = 1.5e-5
+
+
+def log_likelihood(likelihood):
+    """Log scale of a likelihood, AnomalyLikelihood.computeLogLikelihood
+
+    0.9999 maps to about 0.4, 0.99999 to 0.5; works on numpy arrays.
+    """
+    return np.log(1.0000000001 - likelihood) / -23.02585084720009
+
+
+def tail_probability(x, mean, stdev):
+    """Probability of a normal value at least as far from mean as x"""
+    x = np.where(x < mean, 2 * mean - x, x)
+    z = (x - mean) / stdev
+    return 0.5 * np.asarray(_erfc(z / 1.4142), dtype=np.float64)
+
+
+def _estimate(averages, values, start, first, t, scores, averaging_window):
+    """mean and stdev of the averages of records [first, t)
+
+    The moving averages restart at the start of the historic window, so
+    its first averaging_window - 1 averages cover fewer records.
+    """
+    sample = averages[first:t]
+    head = min(start + averaging_window - 1, t)
+    if start > 0 and first < head:
+        sample = sample.copy()
+        partial = np.cumsum(scores[start:head]) / np.arange(1, head - start + 1)
+        sample[:head - first] = partial[first - start:]
+    if np.var(values[first:t]) < MIN_VARIANCE:
+        return NULL_MEAN, NULL_STDEV
+    mean = max(np.mean(sample), 0.03)
+    variance = max(np.var(sample), 0.0003)
+    return mean, math.sqrt(variance)
+
+
+def anomaly_likelihoods(values, raw_scores, learning_period=LEARNING_PERIOD,
+                        estimation_samples=ESTIMATION_SAMPLES,
+                        historic_window=HISTORIC_WINDOW,
+                        reestimation_period=REESTIMATION_PERIOD,
+                        averaging_window=AVERAGING_WINDOW):
+    """Likelihood and log likelihood of every record of a series
+
+    Parameters
+    ----------
+    values : sequence of number
+        the metric values, in time order
+
+    raw_scores : sequence of number
+        the raw anomaly score of each value
+
+    learning_period, estimation_samples, historic_window,
+    reestimation_period, averaging_window
+        as for nupic's AnomalyLikelihood and estimateAnomalyLikelihoods
+
+    Returns
+    -------
+    likelihood, log_likelihood : float64 ndarray
+        what anomalyProbability and computeLogLikelihood return for each
+        record, fed from a fresh AnomalyLikelihood
+
+    Examples
+    --------
+    >>> likelihood, logs = anomaly_likelihoods(series.values, raw)
+    >>> anomalies = series.timestamps[likelihood > 0.9999]
+    """
+    values = np.asarray(values, dtype=np.float64)
+    scores = np.asarray(raw_scores, dtype=np.float64)
+    n = len(scores)
+    likelihood = np.full(n, 0.5)
+    probation = learning_period + estimation_samples
+    if n > probation:
+        total = np.concatenate([[0.0], np.cumsum(scores)])
+        ends = np.arange(1, n + 1)
+        begins = np.maximum(ends - averaging_window, 0)
+        averages = (total[ends] - total[begins]) / (ends - begins)
+
+        """ Estimates on the first record scored and every multiple of
+        reestimation_period after it """
+        later = (probation // reestimation_period + 1) * reestimation_period
+        estimates = [probation] + list(range(later, n, reestimation_period))
+        filtered = np.empty(n)
+        for k, t in enumerate(estimates):
+            stop = estimates[k + 1] if k + 1 < len(estimates) else n
+            start = max(0, t - historic_window)
+            skip = min(t, max(0, learning_period - start))
+            if t - start <= skip:
+                mean, stdev = NULL_MEAN, NULL_STDEV
+            else:
+                mean, stdev = _estimate(averages, values, start, start + skip, t,
+                                        scores, averaging_window)
+            raw = tail_probability(averages[t - 1:stop], mean, stdev)
+            """ raw[0] is the last likelihood of the estimate, the one
+            before the first record of the stretch """
+            red = raw <= RED_THRESHOLD
+            filtered[t:stop] = np.where(red[1:] & red[:-1], YELLOW_THRESHOLD, raw[1:])
+        likelihood[probation:] = 1.0 - filtered[probation:]
+    return likelihood, log_likelihood(likelihood)
+
+
+def _moving_averages(scores, averaging_window):
+    """Averages of scores over the last averaging_window of them, as
+    nupic's MovingAverage computes them, and the window and total left"""
+    window = []
+    total = 0.0
+    averages = []
+    for score in scores:
+        if len(window) == averaging_window:
+            total -= window.pop(0)
+        window.append(score)
+        total += score
+        averages.append(total / len(window))
+    return averages, window, total
+
+
+class StreamingLikelihood(object):
+    """Anomaly likelihood record by record, nupic's AnomalyLikelihood
+
+    Keeps the last historic_window records, estimates the distribution of
+    their moving averages every reestimation_period records once out of
+    probation, and scores each record against the last estimate. Slow,
+    but follows nupic step by step; the reference of the __main__ check.
+
+    Examples
+    --------
+    >>> streaming = StreamingLikelihood()
+    >>> likelihood = [streaming.update(v, s) for v, s in zip(values, raw)]
+    """
+    def __init__(self, learning_period=LEARNING_PERIOD,
+                 estimation_samples=ESTIMATION_SAMPLES,
+                 historic_window=HISTORIC_WINDOW,
+                 reestimation_period=REESTIMATION_PERIOD,
+                 averaging_window=AVERAGING_WINDOW):
+        self.learning_period = learning_period
+        self.probation = learning_period + estimation_samples
+        self.reestimation_period = reestimation_period
+        self.averaging_window = averaging_window
+        self.history = deque(maxlen=historic_window)
+        self.iteration = 0
+        self.distribution = None
+        self.window = []
+        self.total = 0.0
+        self.last_raw = None
+
+    def _reestimate(self):
+        """Estimate the distribution from the records held, as nupic's
+        estimateAnomalyLikelihoods does after skipping the learning period"""
+        shifted = max(0, self.iteration - self.history.maxlen)
+        skip = min(self.iteration, max(0, self.learning_period - shifted))
+        values = [value for value, _ in self.history]
+        averages, self.window, self.total = _moving_averages(
+            [score for _, score in self.history], self.averaging_window)
+        if len(averages) <= skip:
+            mean, stdev = NULL_MEAN, NULL_STDEV
+        elif np.var(values[skip:]) < MIN_VARIANCE:
+            mean, stdev = NULL_MEAN, NULL_STDEV
+        else:
+            mean = max(np.mean(averages[skip:]), 0.03)
+            stdev = math.sqrt(max(np.var(averages[skip:]), 0.0003))
+        self.distribution = (mean, stdev)
+        self.last_raw = float(tail_probability(averages[-1], mean, stdev))
+
+    def update(self, value, raw_score):
+        """Likelihood of the next record
+
+        Parameters
+        ----------
+        value : number
+            the metric value
+
+        raw_score : number
+            its raw anomaly score
+
+        Returns
+        -------
+        likelihood : float
+            what anomalyProbability returns for the record
+        """
+        likelihood = 0.5
+        if self.iteration >= self.probation:
+            if self.distribution is None or \
+                    self.iteration % self.reestimation_period == 0:
+                self._reestimate()
+            if len(self.window) == self.averaging_window:
+                self.total -= self.window.pop(0)
+            self.window.append(raw_score)
+            self.total += raw_score
+            raw = float(tail_probability(self.total / len(self.window),
+                                         *self.distribution))
+            """ the filter looks at the unfiltered likelihood before """
+            filtered = raw
+            if raw <= RED_THRESHOLD and self.last_raw <= RED_THRESHOLD:
+                filtered = YELLOW_THRESHOLD
+            self.last_raw = raw
+            likelihood = 1.0 - filtered
+        self.history.append((value, raw_score))
+        self.iteration += 1
+        return likelihood
+
+
+class _NupicLikelihood(object):
+    """nupic's AnomalyLikelihood behind StreamingLikelihood.update"""
+    def __init__(self, likelihood):
+        self.likelihood = likelihood
+
+    def update(self, value, raw_score):
+        return self.likelihood.anomalyProbability(value, raw_score)
+
+
+if __name__ == "__main__":
+    """ Check against StreamingLikelihood, and nupic's AnomalyLikelihood
+    with --nupic, on the csv files of data/ """
+    import sys
+    import glob
+    import time
+    from optparse import OptionParser
+    import pandas as pd
+    from rtm_batch import rtm_batch
+
+    parser = OptionParser("\n%prog [options] [csv files]"
+                          "\n\nChecks anomaly_likelihoods against StreamingLikelihood,"
+                          "\non data/*.csv by default.")
+    parser.add_option("--nupic", action="store_true", default=False,
+                      help="Check against nupic's AnomalyLikelihood as well. (default: %default)")
+    parser.add_option("--maxDifference", type="float", default=1e-9,
+                      help="Largest likelihood difference accepted. (default: %default)")
+    options, args = parser.parse_args(sys.argv[1:])
+
+    references = [("stream", StreamingLikelihood)]
+    if options.nupic:
+        try:
+            from nupic.algorithms.anomaly_likelihood import AnomalyLikelihood
+        except ImportError:
+            print("nupic is not installed, cannot check against it")
+            sys.exit(1)
+        references.append(("nupic", lambda: _NupicLikelihood(AnomalyLikelihood())))
+
+    files = args or sorted(glob.glob("data/*.csv"))
+    if not files:
+        print("no csv files to check")
+        sys.exit(1)
+    failed = 0
+    for path in files:
+        frame = pd.read_csv(path)
+        values = frame["value"].values.astype(np.float64)
+        if "anomalyScore" in frame:
+            raw = frame["anomalyScore"].values.astype(np.float64)
+        else:
+            raw = rtm_batch(values, 10, 10, values.min(), values.max(), 2, 0,
+                            "right_tail").raw_score
+        start = time.time()
+        likelihood, logs = anomaly_likelihoods(values, raw)
+        report = ["%.3fs" % (time.time() - start)]
+        bad = False
+        for name, reference in references:
+            start = time.time()
+            model = reference()
+            expected = np.array([model.update(v, s)
+                                 for v, s in zip(values.tolist(), raw.tolist())])
+            difference = np.abs(likelihood - expected).max()
+            flips = np.sum((likelihood > 0.9999) != (expected > 0.9999))
+            bad = bad or difference > options.maxDifference or flips > 0
+            report.append("%s: max difference %.3g, %d anomaly flips, %.3fs" % (
+                name, difference, flips, time.time() - start))
+        failed += bad
+        print("%-36s %6d records, %s%s" % (path, len(values), ", ".join(report),
+                                           "  FAILED" if bad else ""))
+    print("%d files failed" % failed)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from optparse import OptionParser
+import os
+import sys
+import json
+import time
+import platform
+import traceback
+import multiprocessing
+try:
+    import resource
+except ImportError:
+    resource = None
+import numpy as np
+
+import oswgen
+import run_anomaly
+from oswdata_ps import OSWData, PS
+from timeseries import TimeSeries
+from scorefile import ScoreWriter
+
+"""
+    NAME
+      bench.py
+
+    DESCRIPTION
+      Benchmarks of the ps ingest and the anomaly detection on synthetic
+      OSWatcher archives.
+
+    NOTES
+      For every size, in hours of snapshots, an archive is generated with
+      oswgen under the work directory (and reused while its parameters do
+      not change), then each case is timed:
+
+        parse : OSWData.traverse_dir of the archive
+        rtm   : run_anomaly._analyze of the ps count series with rtm
+        htm   : the same with htm, skipped when nupic is not installed
+
+      Every run of a case is a fresh process forked from this one, so its
+      peak RSS is its own (base_rss_mb is where it starts) and covers the
+      worker processes too when traverse_dir runs a pool. The best of the
+      repeated runs is reported, with the throughput in snapshots/s, and
+      in uncompressed MB/s for parse, to a JSON result file:
+
+        {"machine": {...}, "params": {...},
+         "results": [{"case": "parse", "hours": 24, "snapshots": 1440,
+                      "seconds": 0.61, "mb_per_second": 90.2,
+                      "snapshots_per_second": 2361.0, "peak_rss_mb": 41.3,
+                      ...}]}
+
+"""
+
+"""Global Variables"""
+CASES = ["parse", "rtm", "htm"]
+SIZES = [1, 24, 168]
+""" Archive parameters of the benchmark, see oswgen.generate """
+ARCHIVE_PARAMS = {"interval": 60, "processes": 372, "spikes": 4,
+                  "formats": ["dat", "gz", "bz2"]}
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process and its finished children"""
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    """ bytes on macOS, KB elsewhere """
+    return peak / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0)
+
+
+def prepare_archive(work_dir, hours, params=None):
+    """Return the path and metadata of the archive of a size, generating
+    it when it is missing or was made with other parameters"""
+    params = dict(ARCHIVE_PARAMS, **(params or {}))
+    params["hours"] = hours
+    path = os.path.join(work_dir, "ps_%dh" % hours)
+    meta = oswgen.load_metadata(path)
+    wanted = dict(oswgen.DEFAULTS, **params)
+    if meta is None or meta["params"] != json.loads(json.dumps(wanted)):
+        if meta is not None:
+            for name in os.listdir(path):
+                os.remove(os.path.join(path, name))
+        meta = oswgen.generate(path, **params)
+    return path, meta
+
+
+def _run_case(case):
+    """Run one case in this process and return its timing"""
+    result = {"seconds": None, "base_rss_mb": _peak_rss_mb()}
+    if case["case"] == "parse":
+        osw = OSWData(path=case["path"], category=PS)
+        start = time.time()
+        osw.traverse_dir(processes=case["processes"])
+        result["seconds"] = time.time() - start
+        series = osw.get_ps_series()
+        result["timestamps"] = series.timestamps
+        result["values"] = series.values
+    else:
+        series = TimeSeries(case["timestamps"], case["values"])
+        detector = run_anomaly.create_detector(case["case"], case["model_params"])
+        start = time.time()
+        detector.fit(series)
+        with ScoreWriter(os.devnull) as writer:
+            anomalies = run_anomaly._analyze(detector, series, writer, verbose=False)
+        result["seconds"] = time.time() - start
+        result["anomalies"] = len(anomalies)
+    result["peak_rss_mb"] = _peak_rss_mb()
+    return result
+
+
+def _case_process(case, conn):
+    """Process entry point, sends the result of a case to conn"""
+    try:
+        run = _run_case(case)
+    except ImportError as e:
+        run = {"skipped": str(e)}
+    except Exception:
+        run = {"error": traceback.format_exc()}
+    conn.send(run)
+    conn.close()
+
+
+def _run_in_process(case):
+    """Run a case in a new process, which may start a pool of its own"""
+    receiver, sender = multiprocessing.Pipe(False)
+    process = multiprocessing.Process(target=_case_process, args=(case, sender))
+    process.start()
+    sender.close()
+    try:
+        run = receiver.recv()
+    except EOFError:
+        run = None
+    process.join()
+    if run is None:
+        run = {"error": "The case process exited with code %s" % process.exitcode}
+    return run
+
+
+def run_case(case, repeat=1):
+    """Run a case repeat times, each in a fresh process
+
+    Returns the run with the shortest time, with the times of all runs,
+    and the largest peak RSS; the first failure or skip is returned as
+    is.
+    """
+    runs = []
+    for _ in range(repeat):
+        run = _run_in_process(case)
+        if "error" in run or "skipped" in run:
+            return run
+        runs.append(run)
+    best = min(runs, key=lambda run: run["seconds"])
+    best["times"] = [run["seconds"] for run in runs]
+    if best["peak_rss_mb"] is not None:
+        best["peak_rss_mb"] = max(run["peak_rss_mb"] for run in runs)
+    return best
+
+
+def run_benchmarks(work_dir, sizes=SIZES, cases=CASES, repeat=3, processes=1,
+                   model_params_file="model_params.json", archive_params=None):
+    """Yield the result of every case at every size
+
+    Parameters
+    ----------
+    work_dir : string
+        directory of the generated archives
+
+    sizes : list of int, default SIZES
+        hours of snapshots of the archives
+
+    cases : list of string, default CASES
+
+    repeat : int, default 3
+        runs of each case, the best is kept
+
+    processes : int, default 1
+        processes of traverse_dir, None for one per CPU
+
+    archive_params : dict, default None
+        oswgen.generate parameters overriding ARCHIVE_PARAMS
+    """
+    with open(model_params_file) as fp:
+        model_params = json.load(fp)
+    for hours in sizes:
+        path, meta = prepare_archive(work_dir, hours, archive_params)
+        info = list(meta["hosts"].values())[0]
+        """ The detectors score the series parsed by the parse case """
+        parsed = run_case({"case": "parse", "path": path, "processes": processes}, repeat)
+        for name in cases:
+            result = {"case": name, "hours": hours, "snapshots": info["snapshots"],
+                      "files": info["files"], "bytes": info["bytes"],
+                      "raw_bytes": info["raw_bytes"]}
+            if name == "parse":
+                run = dict(parsed)
+            elif "error" in parsed:
+                run = {"error": "The parse case failed\n" + parsed["error"]}
+            else:
+                run = run_case({"case": name, "timestamps": parsed["timestamps"],
+                                "values": parsed["values"], "model_params": model_params},
+                               repeat)
+            run.pop("timestamps", None)
+            run.pop("values", None)
+            result.update(run)
+            if run.get("seconds") is not None:
+                seconds = max(run["seconds"], 1e-9)
+                result["snapshots_per_second"] = info["snapshots"] / seconds
+                if name == "parse":
+                    result["mb_per_second"] = info["raw_bytes"] / 1e6 / seconds
+            yield result
+
+
+def _machine():
+    return {"python": platform.python_version(), "numpy": np.__version__,
+            "platform": platform.platform(), "processor": platform.processor(),
+            "cpus": multiprocessing.cpu_count(),
+            "date": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+
+def _print_result(result):
+    if "error" in result:
+        print("%-6s %5dh  FAILED\n%s" % (result["case"], result["hours"], result["error"]))
+        return
+    if "skipped" in result:
+        print("%-6s %5dh  skipped: %s" % (result["case"], result["hours"], result["skipped"]))
+        return
+    rate = ""
+    if "mb_per_second" in result:
+        rate = "%8.1f MB/s" % result["mb_per_second"]
+    print("%-6s %5dh %8d snapshots %8.3fs %10.1f snapshots/s %8.1f MB peak %s" % (
+        result["case"], result["hours"], result["snapshots"], result["seconds"],
+        result["snapshots_per_second"], result["peak_rss_mb"] or 0.0, rate))
+
+
+if __name__ == "__main__":
+    helpString = (
+        "\n%prog [options]"
+        "\n%prog --help"
+        "\n"
+        "\nTimes the ps ingest and the detectors on generated OSWatcher archives."
+    )
+    parser = OptionParser(helpString)
+    parser.add_option("--workDir", default=".bench",
+                      help="Directory of the generated archives. (default: %default)")
+    parser.add_option("--sizes", default=",".join(str(s) for s in SIZES),
+                      help="Comma separated archive sizes, in hours. (default: %default)")
+    parser.add_option("--cases", default=",".join(CASES),
+                      help="Comma separated cases among %s. (default: %%default)"
+                      % ", ".join(CASES))
+    parser.add_option("--repeat", default=3, type=int,
+                      help="Runs of every case, the best is kept. [default: %default]")
+    parser.add_option("--processes", default=1, type=int,
+                      help="Processes of traverse_dir, 0 for one per CPU. [default: %default]")
+    parser.add_option("--interval", default=ARCHIVE_PARAMS["interval"], type=int,
+                      help="Seconds between snapshots of the archives. [default: %default]")
+    parser.add_option("--psProcesses", default=ARCHIVE_PARAMS["processes"], type=int,
+                      help="Mean ps lines per snapshot of the archives. [default: %default]")
+    parser.add_option("--formats", default=",".join(ARCHIVE_PARAMS["formats"]),
+                      help="Mix of dat, gz and bz2 files of the archives. (default: %default)")
+    parser.add_option("--modelParams", default="model_params.json",
+                      help="Model parameters of the htm case. (default: %default)")
+    parser.add_option("--output", default="bench_results.json",
+                      help="JSON result file. (default: %default)")
+    options, args = parser.parse_args(sys.argv[1:])
+
+    cases = options.cases.split(",")
+    for name in cases:
+        if name not in CASES:
+            parser.error("unknown case %r" % name)
+    archive_params = {"interval": options.interval, "processes": options.psProcesses,
+                      "formats": options.formats.split(",")}
+    results = []
+    for result in run_benchmarks(options.workDir, [int(s) for s in options.sizes.split(",")],
+                                 cases, max(options.repeat, 1), options.processes or None,
+                                 options.modelParams, archive_params):
+        _print_result(result)
+        results.append(result)
+    with open(options.output, "w") as fp:
+        json.dump({"machine": _machine(), "params": dict(ARCHIVE_PARAMS, **archive_params),
+                   "results": results}, fp, indent=2, sort_keys=True)
+    print("Results written to " + options.output)
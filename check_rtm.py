@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from optparse import OptionParser
+import sys
+import os
+import math
+import glob
+import tempfile
+import numpy as np
+
+from rtm import LinearRegressionTemoporalMemory
+from rtm_batch import rtm_batch, HISTORY_LENGTH
+from rtm_bank import RTMBank
+from timeseries import TimeSeries
+from csvseries import read_csv_series
+from detectors import RTMDetector
+
+"""
+    NAME
+      check_rtm.py
+
+    DESCRIPTION
+      Regression check of the RTM engines against the original per-point
+      fit.
+
+    NOTES
+      Every csv file of data/ is run through
+
+        baseline  : the per-point push of the original RTM, before the
+                    running sums and slope_sign: it refits the regression
+                    over the whole window, scans the whole repeat history
+                    and takes the raw sign of the slope at every push
+        stream    : LinearRegressionTemoporalMemory.push_refactor
+        restored  : the same, snapshotted half way and restored
+        saved     : a detectors.RTMDetector scoring the first half with
+                    rtm_batch, saved to a file, and a new one loaded from
+                    it scoring the second half, as run_anomaly --stateFile
+                    does between runs
+        batch     : rtm_batch.rtm_batch
+        bank      : a one series rtm_bank.RTMBank
+
+      for every window, critical region and leak detection setting asked
+      for. The raw scores must equal the baseline up to MAX_RAW_DIFFERENCE.
+      The one exception is where a flat window predicts its value up to
+      rounding: the raw score of an error of exactly 0 is 0, that of the
+      smallest error above it is RAW_FLOOR, so either is accepted there.
+
+      The likelihoods must be identical to the baseline, but for the
+      settings of ACCEPTED_DIFFERENCES. There the engines read a slope of
+      rounding noise as flat through rtm_batch.slope_sign where the
+      baseline counted it as rising or falling, which moves the leak
+      counters; every engine must then give the anomalies and likelihood
+      mismatches listed, no more and no fewer. Exits with status 1 on any
+      other difference.
+
+"""
+
+"""Global Variables"""
+ENGINES = ["stream", "restored", "saved", "batch", "bank"]
+""" Largest raw score difference put down to the rounding of the sums """
+MAX_RAW_DIFFERENCE = 1e-9
+""" Raw score of an error just above 0, the sigmoid at -10 """
+RAW_FLOOR = 1 / (1 + math.exp(10))
+""" Likelihoods that differ from the baseline through slope_sign, as
+(file name, window, critical region, leak_detection): (baseline anomalies,
+anomalies, mismatching points). On cpu_5f553 the slope of 2.5e-17 at point
+179 is taken as flat, which resets the descending counter and moves every
+later descending pattern by a few points; at right_tail one anomaly of the
+baseline goes with it. """
+ACCEPTED_DIFFERENCES = {
+    ("cpu_5f553.csv", 7, "right_tail", 1): (28, 27, 255),
+    ("cpu_5f553.csv", 7, "two_tails", 1): (20, 20, 255),
+    ("cpu_5f553 copy.csv", 7, "right_tail", 1): (28, 27, 255),
+    ("cpu_5f553 copy.csv", 7, "two_tails", 1): (20, 20, 255),
+}
+
+
+def baseline_rtm(values, window, interval, min_, max_, boost, leak_detection,
+                 critical_region):
+    """Raw scores and likelihoods of the original per-point push"""
+    n = len(values)
+    raw_score = np.zeros(n)
+    likelihood = np.zeros(n)
+    x = [0] * window
+    y = [0] * window
+    deltas = [0] * (window * HISTORY_LENGTH)
+    slope = intercept = 0
+    ascending = descending = 0
+    allzero = True
+    for i, value in enumerate(values.tolist()):
+        if value != 0:
+            allzero = False
+        if allzero:
+            continue
+        prediction = max(slope * 0 + intercept, 0)
+        for j in range(window - 1):
+            x[j] = x[j + 1] - interval
+        x[-1] = 0
+        y.pop(0)
+        y.append(value)
+
+        x_avg = sum(x) / window
+        y_avg = sum(y) / window
+        xx_sum = 0.0
+        xy_sum = 0.0
+        for j in range(window):
+            xx_sum += (x[j] - x_avg) * (x[j] - x_avg)
+            xy_sum += (x[j] - x_avg) * (y[j] - y_avg)
+        slope = xy_sum / xx_sum
+        intercept = y_avg - slope * x_avg
+
+        if critical_region == "two_tails":
+            delta = abs(prediction - value)
+        elif critical_region == "left_tail":
+            delta = prediction - value
+        else:
+            delta = value - prediction
+        error = max(delta * (boost + 5) / (max_ - min_), 0)
+        raw = 1 / (1 + np.exp(-(40 * error - 10))) if error > 0 else 0
+        level = 0
+        if i + 1 >= window:
+            level = 1 if raw > 0.9 else 0.66 if raw > 0.70 else 0
+        if level > 0:
+            height = sum(y) / len(y) + delta
+            found = [d for d in deltas if d > 0 and height - 3 < d < height + 3]
+            deltas.pop(0)
+            deltas.append(height)
+            if found:
+                level = 0
+        else:
+            deltas.pop(0)
+            deltas.append(0)
+
+        if ascending > 3 * window and leak_detection == 1:
+            level = 1
+            ascending = 0
+        if descending > 3 * window and leak_detection == 1:
+            level = 0.66
+            descending = 0
+        """ a rising slope leaves descending as is, as updateLeakDetection does """
+        if slope > 0:
+            ascending += 1
+        elif slope < 0:
+            ascending = 0
+            descending += 1
+        else:
+            ascending = descending = 0
+        if i + 1 >= window:
+            raw_score[i] = raw
+            likelihood[i] = level
+    return raw_score, likelihood
+
+
+def _stream(series, params, restore_at=None):
+    rtm = LinearRegressionTemoporalMemory(*params, debug=0)
+    n = len(series)
+    raw_score = np.zeros(n)
+    likelihood = np.zeros(n)
+    for i, (timestamp, value) in enumerate(series):
+        if i == restore_at:
+            rtm = LinearRegressionTemoporalMemory.restore(rtm.snapshot())
+        rtm.push_refactor(timestamp, value)
+        raw_score[i] = rtm.rawAnomalyScore
+        likelihood[i] = rtm.anomalyLikelihood
+    return raw_score, likelihood
+
+
+def _saved(series, params):
+    window, interval, min_, max_, boost, leak_detection, critical_region = params
+    half = len(series) // 2
+    parts = [TimeSeries(series.timestamps[:half], series.values[:half], sort=False),
+             TimeSeries(series.timestamps[half:], series.values[half:], sort=False)]
+    fd, path = tempfile.mkstemp(suffix=".model")
+    os.close(fd)
+    results = []
+    try:
+        for i, part in enumerate(parts):
+            detector = RTMDetector(window, interval, boost, leak_detection,
+                                   critical_region)
+            if i == 0:
+                detector.fit(series, min_, max_)
+            else:
+                detector.load(path)
+            results.append(detector.update_batch(part))
+            detector.save(path)
+    finally:
+        os.remove(path)
+    return (np.concatenate([r.raw_score for r in results]),
+            np.concatenate([r.likelihood for r in results]))
+
+
+def _bank(values, params):
+    window, interval, min_, max_, boost, leak_detection, critical_region = params
+    bank = RTMBank(1, window, interval, min_, max_, boost, leak_detection,
+                   critical_region)
+    n = len(values)
+    raw_score = np.zeros(n)
+    likelihood = np.zeros(n)
+    for i in range(n):
+        bank.update(values[i:i + 1])
+        raw_score[i] = bank.raw_score[0]
+        likelihood[i] = bank.likelihood[0]
+    return raw_score, likelihood
+
+
+def run_engines(series, params):
+    """(raw_score, likelihood) of every engine, by name"""
+    batch = rtm_batch(series.values, *params)
+    return {"baseline": baseline_rtm(series.values, *params),
+            "stream": _stream(series, params),
+            "restored": _stream(series, params, len(series) // 2),
+            "saved": _saved(series, params),
+            "batch": (batch.raw_score, batch.likelihood),
+            "bank": _bank(series.values, params)}
+
+
+def accepted_difference(path, params, anomalies):
+    """(baseline anomalies, anomalies, mismatches) expected of a setting,
+    from ACCEPTED_DIFFERENCES or no difference at all"""
+    window, leak_detection, critical_region = params[0], params[5], params[6]
+    key = (os.path.basename(path), window, critical_region, leak_detection)
+    return ACCEPTED_DIFFERENCES.get(key, (anomalies, anomalies, 0))
+
+
+def check_file(path, windows, regions, leaks, interval=10, boost=2):
+    """Yield (params, report) for every setting; report has per engine
+    the anomalies, likelihood mismatches with the baseline and largest raw
+    difference, and the accepted difference of the setting"""
+    series = read_csv_series(path)
+    min_, max_ = series.min(), series.max()
+    for window in windows:
+        for region in regions:
+            for leak in leaks:
+                params = (window, interval, min_, max_, boost, leak, region)
+                outputs = run_engines(series, params)
+                raw, level = outputs["baseline"]
+                anomalies = int(np.sum(level == 1))
+                report = {"baseline": {"anomalies": anomalies},
+                          "accepted": accepted_difference(path, params, anomalies)}
+                for name in ENGINES:
+                    r, l = outputs[name]
+                    difference = np.abs(r - raw)
+                    floor = (np.minimum(r, raw) == 0) & \
+                        (np.abs(np.maximum(r, raw) - RAW_FLOOR) <= MAX_RAW_DIFFERENCE)
+                    report[name] = {"anomalies": int(np.sum(l == 1)),
+                                    "mismatches": int(np.sum(l != level)),
+                                    "raw_difference": float(np.where(floor, 0, difference).max())}
+                yield params, report
+
+
+if __name__ == "__main__":
+    helpString = (
+        "\n%prog [options] [csv files]"
+        "\n%prog --help"
+        "\n"
+        "\nChecks the RTM engines against the original per-point push, on data/*.csv"
+        "\nby default."
+    )
+    parser = OptionParser(helpString)
+    parser.add_option("--windows", default="7,10",
+                      help="Comma separated windows. (default: %default)")
+    parser.add_option("--regions", default="right_tail,two_tails",
+                      help="Comma separated critical regions. (default: %default)")
+    parser.add_option("--leaks", default="0,1",
+                      help="Comma separated leak_detection settings. (default: %default)")
+    options, args = parser.parse_args(sys.argv[1:])
+
+    files = args or sorted(glob.glob("data/*.csv"))
+    windows = [int(w) for w in options.windows.split(",")]
+    leaks = [int(leak) for leak in options.leaks.split(",")]
+    failed = 0
+    for path in files:
+        for params, report in check_file(path, windows, options.regions.split(","), leaks):
+            baseline_anomalies, anomalies, mismatches = report["accepted"]
+            bad = [name for name in ENGINES
+                   if (report[name]["anomalies"], report[name]["mismatches"]) !=
+                   (anomalies, mismatches) or
+                   report[name]["raw_difference"] > MAX_RAW_DIFFERENCE]
+            if report["baseline"]["anomalies"] != baseline_anomalies:
+                bad.insert(0, "baseline")
+            failed += len(bad) > 0
+            print("%-36s w=%-3d %-10s leak=%d %4d anomalies  %s%s%s" % (
+                path, params[0], params[6], params[5], report["baseline"]["anomalies"],
+                " ".join("%s=%d/%d/%.1e" % (name, report[name]["anomalies"],
+                                            report[name]["mismatches"],
+                                            report[name]["raw_difference"])
+                         for name in ENGINES),
+                "  accepted %d/%d/%d" % report["accepted"] if mismatches else "",
+                "  FAILED: " + ", ".join(bad) if bad else ""))
+    print("%d settings failed" % failed)
+    sys.exit(1 if failed else 0)
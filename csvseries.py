@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import calendar
+import collections
+import numpy as np
+import pandas as pd
+
+from timeparse import keys_to_epoch, parse_datetime
+from timeseries import TimeSeries
+
+"""
+    NAME
+      csvseries.py
+
+    DESCRIPTION
+      Chunked columnar reader of the dttm/value csv files of data/.
+
+    NOTES
+      pandas reads CHUNK_ROWS lines at a time into typed columns, with no
+      python object per row; read_csv_series() still concatenates the
+      chunks into one series, in the row order of the file. Timestamps
+      laid out as 'YYYY-MM-DD HH:MM:SS' (with anything after the seconds,
+      e.g. '.000000', ignored) are converted with keys_to_epoch in one
+      go; a chunk with any other layout, such as '25/2/2014 6:45', goes
+      through parse_datetime value by value, as the csv.reader loop did.
+
+"""
+
+"""Global Variables"""
+""" Rows parsed per chunk """
+CHUNK_ROWS = 1 << 16
+
+"""
+One chunk of a csv file
+
+timestamps : int64 ndarray, epoch seconds of the printed wall clock
+values     : float64 ndarray
+labels     : int8 ndarray of the label column, None when there is none
+"""
+CSVChunk = collections.namedtuple('CSVChunk', ['timestamps', 'values', 'labels'])
+
+""" Offsets of the separators and digits of 'YYYY-MM-DD HH:MM:SS' """
+_DASHES = [4, 7]
+_COLONS = [13, 16]
+_DIGITS = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]
+
+
+def texts_to_epoch(texts):
+    """Epoch seconds of an array of timestamp strings"""
+    raw = np.asarray(texts)
+    if raw.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    if raw.dtype.kind != 'S':
+        raw = np.array([t.encode('ascii', 'replace') if isinstance(t, type(u'')) else t
+                        for t in raw.tolist()], dtype='S')
+    chars = raw.astype('S19')
+    if chars.dtype.itemsize == 19:
+        grid = chars.view(np.uint8).reshape(-1, 19)
+        digits = grid[:, _DIGITS]
+        if np.all(grid[:, _DASHES] == ord('-')) and \
+                np.all(grid[:, _COLONS] == ord(':')) and \
+                np.all((grid[:, 10] == ord(' ')) | (grid[:, 10] == ord('T'))) and \
+                np.all((digits >= ord('0')) & (digits <= ord('9'))):
+            return keys_to_epoch(chars)
+    return np.array([calendar.timegm(parse_datetime(t.decode('ascii')).timetuple())
+                     for t in raw.tolist()], dtype=np.int64)
+
+
+def iter_csv_chunks(path, chunk_rows=CHUNK_ROWS, timestamp='dttm', value='value',
+                    label='label'):
+    """Yield the CSVChunk of every chunk_rows rows of a csv file
+
+    Parameters
+    ----------
+    path : string
+        csv file with a header line
+
+    chunk_rows : int, default CHUNK_ROWS
+        rows per chunk
+
+    timestamp, value, label : string
+        names of the columns; the label column is optional, and None
+        leaves it out
+    """
+    header = pd.read_csv(path, nrows=0).columns.tolist()
+    for name in (timestamp, value):
+        if name not in header:
+            raise ValueError("%s has no %r column" % (path, name))
+    columns = [timestamp, value] + ([label] if label in header else [])
+    reader = pd.read_csv(path, usecols=columns, chunksize=chunk_rows,
+                         dtype={timestamp: object, value: np.float64},
+                         na_filter=False, float_precision='round_trip')
+    for frame in reader:
+        labels = None
+        if label in header:
+            labels = frame[label].values.astype(np.int8)
+        yield CSVChunk(texts_to_epoch(frame[timestamp].values),
+                       frame[value].values, labels)
+
+
+def read_csv_series(path, chunk_rows=CHUNK_ROWS, timestamp='dttm', value='value'):
+    """Read the values of a whole csv file chunk by chunk
+
+    Returns
+    -------
+    series : TimeSeries
+        the rows in file order, as the csv.reader loop fed them; a file
+        whose timestamps go backwards gives a series that is not sorted
+        (see TimeSeries.is_sorted)
+    """
+    timestamps, values = [], []
+    for chunk in iter_csv_chunks(path, chunk_rows, timestamp, value, label=None):
+        timestamps.append(chunk.timestamps)
+        values.append(chunk.values)
+    if not timestamps:
+        return TimeSeries()
+    return TimeSeries(np.concatenate(timestamps), np.concatenate(values), sort=False)
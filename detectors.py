@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import copy
+import datetime
+import collections
+import numpy as np
+
+from rtm import LinearRegressionTemoporalMemory, save_detectors, load_detectors
+from rtm_batch import rtm_batch
+from anomaly_likelihood import anomaly_likelihoods, log_likelihood
+try:
+    from nupic.frameworks.opf.modelfactory import ModelFactory
+    from nupic.algorithms.anomaly_likelihood import AnomalyLikelihood
+except ImportError:
+    ModelFactory = None
+    AnomalyLikelihood = None
+
+"""
+    NAME
+      detectors.py
+
+    DESCRIPTION
+      Common interface of the anomaly detectors run by run_anomaly.
+
+    NOTES
+      A detector is set up once per series and then scores its points:
+
+        fit(series, min_=None, max_=None)
+                         set up for the value range of the series, or the
+                         range given
+        update_one(timestamp, value) -> DetectorRecord
+                         score the next point, timestamp in epoch seconds
+        update_batch(series) -> DetectorResult
+                         score the next points of a TimeSeries at once
+        state()          dict of the parameters and counters
+        is_anomaly(likelihood)
+                         whether a likelihood, or an array of them, is
+                         reported as an anomaly
+        save(path), load(path)
+                         write the model to a file, and resume from it in
+                         place of fit(), when supports_state is set
+
+      Detectors whose supports_batch is set score update_batch with array
+      code; the others loop over update_one, so the driver streams their
+      points instead. A new detector is added with register(), e.g.
+      register('mine', MyDetector), and run_anomaly picks it by name.
+
+"""
+
+"""
+Score of one point
+
+raw_score      : raw anomaly score of the detector, between 0 and 1
+likelihood     : anomaly likelihood, between 0 and 1
+log_likelihood : likelihood on a log scale, see log_likelihood()
+anomaly        : whether the detector reports the point
+"""
+DetectorRecord = collections.namedtuple(
+    'DetectorRecord', ['raw_score', 'likelihood', 'log_likelihood', 'anomaly'])
+""" DetectorRecord fields as arrays, one entry per point """
+DetectorResult = collections.namedtuple(
+    'DetectorResult', ['raw_score', 'likelihood', 'log_likelihood', 'anomaly'])
+
+
+# -----------------------------------------------------------------------
+# Detector class
+
+class Detector(object):
+    """Base class of the detectors
+
+    Subclasses implement fit() and update_one(); update_batch() loops over
+    update_one() unless overridden. points and anomalies count the points
+    scored and reported.
+    """
+
+    supports_batch = False
+    supports_state = False
+
+    def __init__(self):
+        self.points = 0
+        self.anomalies = 0
+
+    def fit(self, series, min_=None, max_=None):
+        raise NotImplementedError
+
+    def update_one(self, timestamp, value):
+        raise NotImplementedError
+
+    def update_batch(self, series):
+        n = len(series)
+        raw = np.zeros(n)
+        likelihood = np.zeros(n)
+        logs = np.zeros(n)
+        anomaly = np.zeros(n, dtype=bool)
+        for i, (timestamp, value) in enumerate(series):
+            raw[i], likelihood[i], logs[i], anomaly[i] = \
+                self.update_one(timestamp, value)
+        return DetectorResult(raw, likelihood, logs, anomaly)
+
+    def state(self):
+        return {'points': self.points, 'anomalies': self.anomalies}
+
+    def is_anomaly(self, likelihood):
+        raise NotImplementedError
+
+    def save(self, path):
+        raise NotImplementedError("%s cannot save its model" % type(self).__name__)
+
+    def load(self, path):
+        raise NotImplementedError("%s cannot load a model" % type(self).__name__)
+
+    def _bounds(self, series, min_, max_):
+        if min_ is None:
+            min_ = series.min()
+        if max_ is None:
+            max_ = series.max()
+        return min_, max_
+
+
+# -----------------------------------------------------------------------
+# RTMDetector class
+
+class RTMDetector(Detector):
+    """RTM, LinearRegressionTemoporalMemory, with the rtm_batch engine
+
+    Parameters
+    ----------
+    window, interval, boost, leak_detection, critical_region, range_window
+        as for LinearRegressionTemoporalMemory
+
+    A point is an anomaly where the likelihood is 1. update_batch() on a
+    freshly fitted detector runs rtm_batch; the points it scored are only
+    pushed to the streaming model if update_one() or save() is called
+    afterwards. A detector loaded from a saved model scores the next
+    points as if it had never stopped, with the range it was fitted to.
+    """
+
+    supports_batch = True
+    supports_state = True
+    """ Name of the model in the files of save(), see rtm.save_detectors """
+    STATE_NAME = "rtm"
+
+    def __init__(self, window=10, interval=10, boost=2, leak_detection=0,
+                 critical_region="right_tail", range_window=0):
+        super(RTMDetector, self).__init__()
+        self.window = window
+        self.interval = interval
+        self.boost = boost
+        self.leak_detection = leak_detection
+        self.critical_region = critical_region
+        self.range_window = range_window
+        self.rtm = None
+        """ TimeSeries scored by rtm_batch, not yet pushed to self.rtm """
+        self.pending = []
+
+    def fit(self, series, min_=None, max_=None):
+        self.min_, self.max_ = self._bounds(series, min_, max_)
+        self.rtm = LinearRegressionTemoporalMemory(
+            window=self.window, interval=self.interval, min_=self.min_,
+            max_=self.max_, boost=self.boost, leak_detection=self.leak_detection,
+            critical_region=self.critical_region, debug=0,
+            range_window=self.range_window)
+        self.pending = []
+        return self
+
+    def _catch_up(self):
+        for series in self.pending:
+            for timestamp, value in series:
+                self.rtm.push_refactor(timestamp, value)
+        self.pending = []
+
+    def update_one(self, timestamp, value):
+        if self.pending:
+            self._catch_up()
+        rtm = self.rtm
+        anomaly = rtm.push_refactor(timestamp, value)
+        self.points += 1
+        self.anomalies += anomaly
+        likelihood = float(rtm.anomalyLikelihood)
+        return DetectorRecord(float(rtm.rawAnomalyScore), likelihood,
+                              float(log_likelihood(likelihood)), anomaly)
+
+    def update_batch(self, series):
+        if self.rtm.iterations or self.pending:
+            return super(RTMDetector, self).update_batch(series)
+        result = rtm_batch(series.values, self.window, self.interval,
+                           self.min_, self.max_, self.boost,
+                           self.leak_detection, self.critical_region,
+                           self.range_window)
+        anomaly = self.is_anomaly(result.likelihood)
+        self.pending.append(series)
+        self.points += len(series)
+        self.anomalies += int(anomaly.sum())
+        return DetectorResult(result.raw_score, result.likelihood,
+                              log_likelihood(result.likelihood), anomaly)
+
+    def is_anomaly(self, likelihood):
+        return likelihood == 1
+
+    def save(self, path):
+        """Write the streaming model, with every point scored so far"""
+        if self.pending:
+            self._catch_up()
+        save_detectors(path, {self.STATE_NAME: self.rtm})
+
+    def load(self, path):
+        """Resume from the model written by save(), in place of fit()"""
+        rtm = load_detectors(path)[self.STATE_NAME]
+        saved = (rtm.window, rtm.interval, rtm.boost, rtm.leak_detection,
+                 rtm.critical_region, rtm.rangeWindow if rtm.adaptive else 0)
+        wanted = (self.window, self.interval, self.boost, self.leak_detection,
+                  self.critical_region, self.range_window)
+        if saved != wanted:
+            raise ValueError("%s was saved with the parameters %s, not %s"
+                             % (path, saved, wanted))
+        self.rtm = rtm
+        self.min_, self.max_ = rtm.min_, rtm.max_
+        self.pending = []
+        self.points = rtm.iterations
+        self.anomalies = rtm.anomalies
+        return self
+
+    def state(self):
+        state = super(RTMDetector, self).state()
+        state.update(window=self.window, interval=self.interval,
+                     boost=self.boost, leak_detection=self.leak_detection,
+                     critical_region=self.critical_region,
+                     range_window=self.range_window)
+        return state
+
+
+# -----------------------------------------------------------------------
+# HTMDetector class
+
+def create_htm_model(modelParams, min_, max_, resolution=None):
+    """Create a CLA model whose value encoder covers [min_, max_]"""
+    modelParams = copy.deepcopy(modelParams)
+    # Update the resolution value for the encoder
+    sensorParams = modelParams['modelParams']['sensorParams']
+    numBuckets = sensorParams['encoders']['value'].pop('numBuckets')
+    if resolution is None:
+        resolution = max(0.001, (max_ - min_) / numBuckets)
+    print("Using resolution value: {0}".format(resolution))
+    sensorParams['encoders']['value']['resolution'] = resolution
+
+    model = ModelFactory.create(modelParams)
+    model.enableInference({'predictedField': 'value'})
+    return model
+
+
+class HTMDetector(Detector):
+    """NuPIC CLA model with an AnomalyLikelihood
+
+    Parameters
+    ----------
+    modelParams : dict
+        the OPF model parameters, e.g. model_params.json
+
+    resolution : float, default None
+        resolution of the value encoder, (max_ - min_) / numBuckets by
+        default
+
+    threshold : float, default 0.9999
+        likelihood above which a point is an anomaly
+
+    Needs nupic. The model runs one point at a time, but update_batch()
+    on a freshly fitted detector computes the likelihoods of all points
+    at once with anomaly_likelihoods; they are only pushed to the
+    AnomalyLikelihood if update_one() is called afterwards.
+    """
+
+    supports_batch = True
+
+    def __init__(self, modelParams, resolution=None, threshold=0.9999):
+        super(HTMDetector, self).__init__()
+        self.modelParams = modelParams
+        self.resolution = resolution
+        self.threshold = threshold
+        self.model = None
+        self.likelihood = None
+        """ (TimeSeries, raw scores) of update_batch, not yet pushed to
+        self.likelihood """
+        self.pending = []
+
+    def fit(self, series, min_=None, max_=None):
+        if ModelFactory is None:
+            raise ImportError("The HTM detector needs nupic")
+        min_, max_ = self._bounds(series, min_, max_)
+        self.model = create_htm_model(self.modelParams, min_, max_, self.resolution)
+        self.likelihood = AnomalyLikelihood()
+        self.pending = []
+        return self
+
+    def _raw_score(self, timestamp, value):
+        dttm = datetime.datetime.utcfromtimestamp(timestamp)
+        result = self.model.run({'value': value, 'dttm': dttm})
+        return result.inferences['anomalyScore'], dttm
+
+    def _catch_up(self):
+        for series, raw in self.pending:
+            for (timestamp, value), score in zip(series, raw.tolist()):
+                self.likelihood.anomalyProbability(
+                    value, score, datetime.datetime.utcfromtimestamp(timestamp))
+        self.pending = []
+
+    def update_one(self, timestamp, value):
+        if self.pending:
+            self._catch_up()
+        raw, dttm = self._raw_score(timestamp, value)
+        likelihood = self.likelihood.anomalyProbability(value, raw, dttm)
+        anomaly = self.is_anomaly(likelihood)
+        self.points += 1
+        self.anomalies += anomaly
+        return DetectorRecord(raw, likelihood,
+                              self.likelihood.computeLogLikelihood(likelihood),
+                              anomaly)
+
+    def update_batch(self, series):
+        if self.points or self.pending:
+            return super(HTMDetector, self).update_batch(series)
+        raw = np.zeros(len(series))
+        for i, (timestamp, value) in enumerate(series):
+            raw[i] = self._raw_score(timestamp, value)[0]
+        likelihood, logs = anomaly_likelihoods(series.values, raw)
+        anomaly = self.is_anomaly(likelihood)
+        self.pending.append((series, raw))
+        self.points += len(series)
+        self.anomalies += int(anomaly.sum())
+        return DetectorResult(raw, likelihood, logs, anomaly)
+
+    def is_anomaly(self, likelihood):
+        return likelihood > self.threshold
+
+    def state(self):
+        state = super(HTMDetector, self).state()
+        state.update(resolution=self.resolution, threshold=self.threshold)
+        return state
+
+
+"""Global Variables"""
+""" Detector name -> class or factory, see register() """
+DETECTORS = collections.OrderedDict([('rtm', RTMDetector), ('htm', HTMDetector)])
+
+
+def register(name, factory):
+    """Make a detector class or factory available by name"""
+    DETECTORS[name] = factory
+
+
+def create(name, **params):
+    """Instantiate the detector registered as name with params"""
+    try:
+        factory = DETECTORS[name]
+    except KeyError:
+        raise ValueError("Unknown detector %r, expected one of %s"
+                         % (name, ", ".join(DETECTORS)))
+    return factory(**params)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import struct
+import hashlib
+
+from oswdata_ps import PSPartial
+from timeparse import key_to_epoch, epoch_to_key
+
+"""
+    NAME
+      oswdata_cache.py
+
+    DESCRIPTION
+      On-disk cache of the parsed results of osw archive files.
+
+    NOTES
+      Every entry holds the PSPartial of one file in a small binary file:
+      a header, then the snapshot timestamps as int64 epoch seconds and the
+      ps counts as int32, one column after the other.
+
+"""
+
+"""Global Variables"""
+CACHE_MAGIC = b"OSWPSC"
+CACHE_VERSION = 1
+CACHE_HEADER = struct.Struct("<6sBqI")   # magic, version, head, n
+""" Bytes hashed at each end of a file to detect rewrites """
+HASH_BLOCK = 64 * 1024
+
+
+# -----------------------------------------------------------------------
+# OSWCache class
+
+class OSWCache(object):
+    """Cache of per-file ps results keyed by file identity
+
+    Parameters
+    ----------
+    path : string
+        cache directory, created if needed
+
+    max_bytes : int, default 256 MB
+        total size of the entries kept; the least recently used ones are
+        evicted beyond it
+
+    Examples
+    --------
+    >>> cache = OSWCache('/var/tmp/oswps.cache')
+    >>> osw = OSWData(path='oswps', category=PS)
+    >>> osw.traverse_dir(cache=cache)
+
+    An entry is found again only if the file has the same path, size,
+    mtime and the same first and last HASH_BLOCK bytes, so changed files
+    are parsed again and their old entries age out. The index is only
+    rewritten when entries are added or dropped; the use times of the
+    hits of a run are saved with it then.
+    """
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        self.index_path = os.path.join(self.path, "index.json")
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as fp:
+                self.index = json.load(fp)
+        self.dirty = False
+
+    def _key(self, filepath, category):
+        st = os.stat(filepath)
+        h = hashlib.sha1()
+        h.update(("%s\0%s\0%d\0%r\0" % (os.path.abspath(filepath), category,
+                                        st.st_size, st.st_mtime)).encode("utf-8"))
+        with open(filepath, "rb") as f:
+            h.update(f.read(HASH_BLOCK))
+            if st.st_size > 2 * HASH_BLOCK:
+                f.seek(-HASH_BLOCK, os.SEEK_END)
+                h.update(f.read(HASH_BLOCK))
+        return h.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key + ".psc")
+
+    def get(self, filepath, category):
+        """Return the cached PSPartial of filepath, or None"""
+        key = self._key(filepath, category)
+        if key not in self.index:
+            return None
+        try:
+            with open(self._entry_path(key), "rb") as f:
+                partial = _unpack_partial(f.read())
+        except (IOError, OSError, ValueError, struct.error):
+            self._drop(key)
+            return None
+        """ The use time is only written back along with a put or a drop,
+        so a run that hits for every file leaves the index untouched """
+        self.index[key]['used'] = time.time()
+        return partial
+
+    def put(self, filepath, category, partial):
+        """Store the PSPartial of filepath"""
+        key = self._key(filepath, category)
+        data = _pack_partial(partial)
+        with open(self._entry_path(key), "wb") as f:
+            f.write(data)
+        self.index[key] = {'file': os.path.abspath(filepath),
+                           'bytes': len(data), 'used': time.time()}
+        self.dirty = True
+
+    def _drop(self, key):
+        try:
+            os.remove(self._entry_path(key))
+        except OSError:
+            pass
+        self.index.pop(key, None)
+        self.dirty = True
+
+    def evict(self):
+        """Drop the least recently used entries beyond max_bytes"""
+        total = sum(e['bytes'] for e in self.index.values())
+        by_age = sorted(self.index.items(), key=lambda kv: kv[1]['used'])
+        for key, entry in by_age:
+            if total <= self.max_bytes:
+                break
+            total -= entry['bytes']
+            self._drop(key)
+
+    def flush(self):
+        """Evict and write the index back if anything changed"""
+        if not self.dirty:
+            return
+        self.evict()
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w") as fp:
+            json.dump(self.index, fp)
+        os.rename(tmp, self.index_path)
+        self.dirty = False
+
+
+def _pack_partial(partial):
+    n = len(partial.keys)
+    stamps = [key_to_epoch(k) for k in partial.keys]
+    return (CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, partial.head, n) +
+            struct.pack("<%dq" % n, *stamps) +
+            struct.pack("<%di" % n, *partial.counts))
+
+
+def _unpack_partial(data):
+    magic, version, head, n = CACHE_HEADER.unpack_from(data, 0)
+    if magic != CACHE_MAGIC or version != CACHE_VERSION:
+        raise ValueError("Not a version %d cache entry" % CACHE_VERSION)
+    offset = CACHE_HEADER.size
+    stamps = struct.unpack_from("<%dq" % n, data, offset)
+    counts = struct.unpack_from("<%di" % n, data, offset + 8 * n)
+    keys = [epoch_to_key(t) for t in stamps]
+    return PSPartial(head, keys, list(counts))
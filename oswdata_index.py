@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import mmap
+import hashlib
+import struct
+import bisect
+
+from timeparse import zzz_to_epoch
+
+"""
+    NAME
+      oswdata_index.py
+
+    DESCRIPTION
+      Index of the zzz snapshot markers of plain osw .dat files.
+
+    NOTES
+      The index of 'host_ps_16.10.17.0900.dat' is a header with the size
+      and mtime of the indexed file, then the byte offset of every
+      'zzz ***' marker and its timestamp as epoch seconds, both int64
+      columns. Timestamps are taken as printed, ignoring the zone, to line
+      up with the 'YYYY-MM-DD HH:MM:SS' snapshot keys of OSWData.
+
+      An index is only persisted to a path given to it, in a directory of
+      its own such as the --cacheDir of run_anomaly (see index_path()),
+      never next to the archive, which may be read-only or shared.
+
+"""
+
+"""Global Variables"""
+ZZZ_MARKER = b"zzz ***"
+INDEX_SUFFIX = ".zzzidx"
+INDEX_MAGIC = b"OSWZZZ"
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct("<6sBqdI")   # magic, version, size, mtime, n
+
+
+# -----------------------------------------------------------------------
+# OSWIndex class
+
+class OSWIndex(object):
+    """zzz marker index of one plain osw file
+
+    Parameters
+    ----------
+    filepath : string
+        path of the .dat file
+
+    index_path : string, default None
+        where to persist the index; None keeps it in memory only
+
+    Examples
+    --------
+    >>> dat = 'oswps/acmsdbv2024_ps_16.10.17.0900.dat'
+    >>> idx = OSWIndex(dat, index_path(dat, '/var/tmp/oswps.cache/zzzidx')).load()
+    >>> i, j = idx.find(1476695400, 1476696000)
+    >>> lines = idx.read_blocks(i, j)
+
+    Block i spans from marker i up to marker i+1, so text glued in front
+    of a marker ('...skzzz ***Wed Oct 19') belongs to the block before it,
+    as in OSWData._analyse_ps_data.
+    """
+
+    def __init__(self, filepath, index_path=None):
+        self.filepath = filepath
+        self.index_path = index_path
+        self.size = 0
+        self.mtime = 0.0
+        self.offsets = []
+        self.stamps = []
+
+    def load(self):
+        """Load the persisted index, bringing it up to date with the file
+
+        A file that only grew is indexed from the last known marker on;
+        any other change rebuilds the index from scratch.
+        """
+        st = os.stat(self.filepath)
+        if self.index_path is not None and os.path.exists(self.index_path):
+            try:
+                self._read()
+            except (IOError, OSError, ValueError, struct.error):
+                self.size = 0
+                self.offsets = []
+                self.stamps = []
+
+        if self.size == st.st_size and self.mtime == st.st_mtime:
+            return self
+        if self.size > st.st_size or (self.size == st.st_size and self.offsets):
+            self.offsets = []
+            self.stamps = []
+        self._scan()
+        self.save()
+        return self
+
+    def _scan(self):
+        """Index the markers after the last known one"""
+        start = self.offsets.pop() if self.offsets else 0
+        if self.stamps:
+            self.stamps.pop()
+        st = os.stat(self.filepath)
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        if self.size == 0:
+            return
+        with open(self.filepath, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                pos = mm.find(ZZZ_MARKER, start)
+                while pos >= 0:
+                    eol = mm.find(b"\n", pos)
+                    if eol < 0:
+                        eol = self.size
+                    try:
+                        stamp = zzz_to_epoch(mm[pos:eol].decode("ascii", "replace"),
+                                             utc_offset=0)
+                    except ValueError:
+                        stamp = None
+                    if stamp is not None:
+                        self.offsets.append(pos)
+                        self.stamps.append(stamp)
+                    pos = mm.find(ZZZ_MARKER, pos + len(ZZZ_MARKER))
+            finally:
+                mm.close()
+
+    def _read(self):
+        with open(self.index_path, "rb") as f:
+            data = f.read()
+        magic, version, size, mtime, n = INDEX_HEADER.unpack_from(data, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError("Not a version %d zzz index" % INDEX_VERSION)
+        offset = INDEX_HEADER.size
+        self.offsets = list(struct.unpack_from("<%dq" % n, data, offset))
+        self.stamps = list(struct.unpack_from("<%dq" % n, data, offset + 8 * n))
+        self.size = size
+        self.mtime = mtime
+
+    def save(self):
+        if self.index_path is None:
+            return
+        folder = os.path.dirname(self.index_path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        n = len(self.offsets)
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION,
+                                      self.size, self.mtime, n))
+            f.write(struct.pack("<%dq" % n, *self.offsets))
+            f.write(struct.pack("<%dq" % n, *self.stamps))
+        os.rename(tmp, self.index_path)
+
+    def find(self, start=None, end=None):
+        """Return the block range [i, j) with start <= timestamp < end
+
+        The markers of a file are in time order, so this is a bisection of
+        the timestamp column.
+        """
+        i = 0 if start is None else bisect.bisect_left(self.stamps, start)
+        j = len(self.stamps) if end is None else bisect.bisect_left(self.stamps, end)
+        return i, max(i, j)
+
+    def read_blocks(self, i, j):
+        """Return the lines of blocks [i, j), reading only their bytes
+
+        Reading from block 0 starts at the top of the file, so the lines
+        before the first marker come along for the caller to handle.
+        """
+        if i >= j:
+            return []
+        begin = self.offsets[i] if i > 0 else 0
+        finish = self.offsets[j] if j < len(self.offsets) else self.size
+        with open(self.filepath, "rb") as f:
+            f.seek(begin)
+            data = f.read(finish - begin)
+        if not isinstance(data, str):
+            data = data.decode("utf-8", "replace")
+        return data.splitlines(True)
+
+
+def index_path(filepath, directory):
+    """Path of the index of filepath kept in directory
+
+    The name starts with a hash of the directory of filepath, so the
+    archives of several hosts can share one index directory.
+    """
+    folder = os.path.dirname(os.path.abspath(filepath))
+    digest = hashlib.sha1(folder.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(directory, "%s_%s%s" % (digest, os.path.basename(filepath),
+                                                INDEX_SUFFIX))
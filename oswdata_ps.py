@@ -4,10 +4,28 @@
 import sys
 import os
 import re
-import subprocess
+import gzip
+import bz2
 import calendar
 import datetime
 import time
+import array
+import collections
+import multiprocessing
+import json
+import numpy as np
+from oswdata_index import OSWIndex, index_path
+from timeparse import key_to_epoch, keys_to_epoch, epoch_to_key
+from timeseries import TimeSeries
+from psparse import PSSnapshot, parse_ps_block, iter_blocks, command_name, \
+    NAME_WIDTH, CMD_WIDTH
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
 #from certifi import __main__
 
 __version__ = "1.0.0.170928"
@@ -37,6 +55,40 @@ Category List
 PS = "ps"
 TOP = "top"
 
+"""
+Compression magic bytes, checked in place of the file extension
+"""
+GZIP_MAGIC = b"\x1f\x8b"
+BZ2_MAGIC = b"BZh"
+XZ_MAGIC = b"\xfd7zXZ\x00"
+
+"""
+Per-file result of the ps analyzer, merged into the ps series of OSWData
+
+head   : number of ps lines before the first zzz of the file, i.e. the
+         tail of a snapshot that started in the previous file
+keys   : snapshot timestamps in file order
+counts : array of ps line counts, one per key
+"""
+PSPartial = collections.namedtuple('PSPartial', ['head', 'keys', 'counts'])
+
+"""
+Per-file result of the ps group analyzer, merged by OSWData.traverse_groups
+
+keys   : snapshot timestamps in file order
+names  : group names, indexed by the ids below; ids are local to the file
+ids    : per key, int array of the ids of the groups seen in the snapshot
+counts : per key, int array of the ps line counts of those groups
+"""
+PSGroupPartial = collections.namedtuple('PSGroupPartial',
+                                        ['keys', 'names', 'ids', 'counts'])
+
+"""
+Group keys of traverse_groups; any other value is taken as a regex
+"""
+GROUP_BY_CMD = "cmd"
+GROUP_BY_USER = "user"
+
 
 """Global Variables"""
 
@@ -57,6 +109,11 @@ class OSWData(object):
 
     category : string, default None
         type of the osw data, e.g. meminfo 
+
+    zzz_index_dir : string, default None
+        directory keeping the zzz indexes of query(); without one they
+        are rebuilt in memory on every call. Nothing is written to the
+        archive directory itself.
         
     Examples
     --------
@@ -75,7 +132,7 @@ class OSWData(object):
     
     """
 
-    def __init__(self, path=None, category=None):
+    def __init__(self, path=None, category=None, zzz_index_dir=None):
         """OSWData class, init"""
         if path is None:
             raise ValueError("The 'path' arg is invalid!")
@@ -85,11 +142,18 @@ class OSWData(object):
 
         self.path = path
         self.category = category
+        self.zzz_index_dir = zzz_index_dir
 
-        self.ps_dict = {}
-        self.dat_pattern = re.compile(".*.dat$")
-        self.gz_pattern = re.compile(".*(.gz|.gzip)$")
-        self.bz2_pattern = re.compile(".*.bz2$")
+        #(timestamps, counts) arrays of the merged files, in merge order
+        self._ps_parts = []
+        self._last_key = None
+        self.group_names = []
+        self.group_keys = []
+        self.group_counts = None
+        self._date_cache = {}
+        #osw naming stem host_ps_YY.MM.DD.HHMM, then .dat and any other suffix
+        self.osw_pattern = re.compile(".*_\\d{2}\\.\\d{2}\\.\\d{2}\\.\\d{4}(\\.dat)?(\\..+)?$")
+        self.hour_pattern = re.compile(".*_(\\d{2})\\.(\\d{2})\\.(\\d{2})\\.(\\d{2})(\\d{2})(?:\\.|$)")
 
 #         if self.category == "top":
 #             do_topfile(path=self.path, category=self.category)
@@ -276,23 +340,84 @@ class OSWData(object):
 # 
 #         return keypair_dict
 
+    def _compression(self, filepath):
+        """Return 'gzip', 'bz2', 'xz' or None from the file's magic bytes"""
+        with open(filepath, "rb") as f:
+            magic = f.read(len(XZ_MAGIC))
+
+        if magic.startswith(GZIP_MAGIC):
+            return "gzip"
+        elif magic.startswith(BZ2_MAGIC):
+            return "bz2"
+        elif magic.startswith(XZ_MAGIC):
+            return "xz"
+        return None
+
+    def _openfile(self, filepath):
+        """Open an osw file for binary reading, decompressing in process
+
+        The compression is detected from the magic bytes at the start of
+        the file, so renamed or extension-less archives are read correctly;
+        see _is_osw_file for the files picked from a directory.
+        """
+        compression = self._compression(filepath)
+        if compression == "gzip":
+            return gzip.open(filepath, "rb")
+        elif compression == "bz2":
+            return bz2.BZ2File(filepath, "rb")
+        elif compression == "xz":
+            if lzma is None:
+                raise ValueError("No lzma module to read " + filepath)
+            return lzma.open(filepath, "rb")
+        return open(filepath, "rb")
+
+    def _is_osw_file(self, filepath):
+        """True for a file with the osw naming stem that is either plain,
+        with no suffix beyond .dat, or compressed whatever its suffix
+
+        e.g. 'host_ps_16.10.17.0900.dat', 'host_ps_16.10.17.0900' and a
+        gzip 'host_ps_16.10.17.0900.Z' are picked, the zzz index
+        'host_ps_16.10.17.0900.dat.zzzidx' is not.
+        """
+        m = self.osw_pattern.match(os.path.basename(filepath))
+        if m is None or not os.path.isfile(filepath):
+            return False
+        return m.group(2) is None or self._compression(filepath) is not None
+
     def _readfile(self, filepath):
-        with open(filepath, "r") as f:
-            return f.readlines()
+        """Yield the lines of a plain or compressed osw file one at a time"""
+        with self._openfile(filepath) as f:
+            for line in f:
+                if not isinstance(line, str):
+                    line = line.decode("utf-8", "replace")
+                yield line
 
-    def _pipefile(self, cmd, file):
-        p = subprocess.Popen([cmd, file], stdout=subprocess.PIPE)
-        return p.stdout.readlines()
+    def _tailfile(self, filepath, offset, pos, complete=True):
+        """Yield the lines of a plain osw file starting at a byte offset
+
+        pos is a dict updated with 'end', the offset just after the last
+        line yielded, and 'zzz', the offset of the last zzz line yielded.
+        When complete is False the file is still being written and a
+        trailing line without newline is left for the next read.
+        """
+        pos['end'] = offset
+        with open(filepath, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not complete and not line.endswith(b"\n"):
+                    break
+                if b"zzz" in line:
+                    pos['zzz'] = pos['end']
+                pos['end'] += len(line)
+                if not isinstance(line, str):
+                    line = line.decode("utf-8", "replace")
+                yield line
 
     def osw_foreach(self):
         dat_list = os.listdir(self.dir)
         dat_list.sort()
         for f in dat_list:
-            if self.gz_pattern.match(f):
-                self._pipefile('zcat', f)
-            elif self.bz2_pattern.match(f):
-                self._pipefile('bzcat', f)
-            elif self.dat_pattern.match(f):
+            if self._is_osw_file(os.path.join(self.dir, f)):
                 self._readfile(f)
 
     def _month_to_number_str(self, string):
@@ -321,27 +446,37 @@ class OSWData(object):
             raise ValueError('Not a month' + string)
     
     def _convert_zzz_to_timestamp(self, zzz):
-        month = self._month_to_number_str(zzz[11:14])
-        day = zzz[15:17]
-        hms = zzz[18:26]
-        year= zzz[-4:]
-        result = '-'.join([year, month, day]) + ' ' + hms
-        return result
+        """ Only the time of day changes between most markers """
+        prefix = (zzz[11:17], zzz[-4:])
+        date = self._date_cache.get(prefix)
+        if date is None:
+            month = self._month_to_number_str(zzz[11:14])
+            day = zzz[15:17]
+            year = zzz[-4:]
+            date = self._date_cache[prefix] = '-'.join([year, month, day])
+        return date + ' ' + zzz[18:26]
         
     def _analyse_ps_data(self, lines):
-        # Ignore several leading lines without zzz
-        line_num = -1
+        """Count the ps lines of every zzz snapshot in one pass
+
+        Parameters
+        ----------
+        lines : iterable of string
+            lines of one osw ps file, consumed lazily
+
+        Returns
+        -------
+        partial : PSPartial
+            the snapshots of this file. The 'Linux OSW v2.1.1' banner is
+            ignored; any other ps lines before the first zzz are returned
+            as head so that the merge can give them to the snapshot that
+            straddles from the previous file.
+        """
+        head = 0
+        keys = []
+        counts = array.array('l')
         for l in lines:
-            line_num += 1
-            l = l.strip().lstrip().rstrip()
-            if l == "":
-                continue
-            if 'zzz' in l:
-                break
-                
-        cur_key = ""
-        for l in lines[line_num:]:
-            l = l.strip().lstrip().rstrip()
+            l = l.strip()
             if l == "":
                 continue
             if 'PPID' in l:
@@ -350,34 +485,538 @@ class OSWData(object):
                 """ Sometimes zzz is not at the beginning """
                 zzz_start = l.index('zzz')
                 if zzz_start != 0:
-                    self.ps_dict[cur_key] += 1
-                    
+                    if keys:
+                        counts[-1] += 1
+                    else:
+                        head += 1
+
                 """ Switch to new zzz """
-                cur_key = self._convert_zzz_to_timestamp(l[zzz_start:])
-                self.ps_dict[cur_key] = 0
-            else:
-                self.ps_dict[cur_key] += 1
+                keys.append(self._convert_zzz_to_timestamp(l[zzz_start:]))
+                counts.append(0)
+            elif keys:
+                counts[-1] += 1
+            elif 'OSW v' not in l:
+                head += 1
+        return PSPartial(head, keys, counts)
+
+    def iter_ps_snapshots(self, filepath=None, name_width=NAME_WIDTH, cmd_width=CMD_WIDTH):
+        """Yield the ps columns of every snapshot
+
+        Parameters
+        ----------
+        filepath : string, default None
+            osw ps file to read, every file of the directory by default
+
+        name_width, cmd_width : int or None, default NAME_WIDTH, CMD_WIDTH
+            bytes kept of the user names and commands, None for all of
+            them, see psparse.parse_ps_block
+
+        Yields
+        ------
+        snapshot : PSSnapshot
+            'YYYY-MM-DD HH:MM:SS' key, and a dict of column arrays (pid,
+            ppid, uid, sz, time, cmd, ... as found in the header), see
+            psparse.parse_ps_block
+
+        Examples
+        --------
+        >>> for key, cols in osw.iter_ps_snapshots():
+        ...     big = cols['sz'] > 1000000
+        ...     print(key, big.sum(), cols['cmd'][big][:3])
+        """
+        file_list = [filepath] if filepath is not None else self._list_files()
+        for f in file_list:
+            with self._openfile(f) as fp:
+                for block in iter_blocks(fp):
+                    zzz, header, columns = parse_ps_block(block, name_width=name_width,
+                                                          cmd_width=cmd_width)
+                    key = self._convert_zzz_to_timestamp(zzz)
+                    yield PSSnapshot(key, columns)
+
+    def _merge_ps_partial(self, partial):
+        """Merge the partial result of the next file into the ps series
+
+        Files must be merged in name order. The head of a file and a first
+        snapshot repeating the last timestamp of the previous file are both
+        the continuation of that snapshot and are added to its count.
+        """
+        keys = partial.keys
+        counts = np.array(partial.counts, dtype=np.int64)
+        if self._last_key is not None:
+            last = self._ps_parts[-1][1]
+            last[-1] += partial.head
+            if keys and keys[0] == self._last_key:
+                last[-1] += counts[0]
+                keys = keys[1:]
+                counts = counts[1:]
+        if keys:
+            self._ps_parts.append((keys_to_epoch(keys), counts))
+            self._last_key = keys[-1]
 
     def _analyse_data_from_one_file(self, filepath):
-        if self.gz_pattern.match(filepath):
-            lines = self._pipefile('zcat', filepath)
-        elif self.bz2_pattern.match(filepath):
-            lines = self._pipefile('bzcat', filepath)
-        elif self.dat_pattern.match(filepath):
-            lines = self._readfile(filepath)
+        if not self._is_osw_file(filepath):
+            return None
+        lines = self._readfile(filepath)
 
         if self.category == PS:
             #print("====== " + filepath + " ======")
-            self._analyse_ps_data(lines)
+            return self._analyse_ps_data(lines)
+        return None
+
+    def _list_files(self):
+        file_list = sorted(os.listdir(self.path))
+        file_list = [os.path.join(self.path, f) for f in file_list]
+        return [f for f in file_list if self._is_osw_file(f)]
+
+    def _analyse_files(self, file_list, processes=1):
+        """Yield the PSPartial of every file of file_list, in order"""
+        if processes == 1:
+            for f in file_list:
+                yield self._analyse_data_from_one_file(f)
+            return
+
+        pool = multiprocessing.Pool(processes)
+        try:
+            args = [(self.path, self.category, f) for f in file_list]
+            for partial in pool.imap(_analyse_file_worker, args):
+                yield partial
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    def traverse_dir(self, processes=1, cache=None):
+        """Analyse every osw file of the directory
+
+        Parameters
+        ----------
+        processes : int, default 1
+            number of worker processes. 1 parses the files in this process,
+            None uses one worker per CPU. The per-file results are merged
+            in file name order, so the result does not depend on it.
+
+        cache : OSWCache, default None
+            cache of per-file results; only the files missing from it are
+            parsed, and their results are added to it
+        """
+        file_list = self._list_files()
+        if cache is None:
+            partials = self._analyse_files(file_list, processes)
+        else:
+            partials = [cache.get(f, self.category) for f in file_list]
+            todo = [i for i, p in enumerate(partials) if p is None]
+            parsed = self._analyse_files([file_list[i] for i in todo], processes)
+            for i, partial in zip(todo, parsed):
+                partials[i] = partial
+                if partial is not None:
+                    cache.put(file_list[i], self.category, partial)
+            cache.flush()
+
+        for partial in partials:
+            if partial is not None:
+                self._merge_ps_partial(partial)
+
+    def _group_of(self, by):
+        """Return the function mapping a ps line to its group name or None"""
+        if by == GROUP_BY_CMD:
+            return command_name
+        if by == GROUP_BY_USER:
+            return lambda user: user.decode("ascii", "replace")
+        regex = re.compile(by) if not hasattr(by, 'search') else by
+
+        def group(cmd):
+            m = regex.search(cmd.decode("ascii", "replace"))
+            if m is None:
+                return None
+            return m.group(1) if m.groups() else m.group(0)
+        return group
+
+    def _group_data_from_one_file(self, filepath, by):
+        """Count the ps lines of every snapshot of one file per group
+
+        The column values are read whole, not cut to CMD_WIDTH, so a
+        regex sees the full command line. They are interned: each
+        distinct command line is mapped to a group only once per file,
+        and a snapshot costs one np.unique plus one bincount.
+        """
+        column = 'uid' if by == GROUP_BY_USER else 'cmd'
+        group_of = self._group_of(by)
+        names = []
+        name_ids = {}
+        value_ids = {}
+        keys, ids, counts = [], [], []
+        for key, columns in self.iter_ps_snapshots(filepath, None, None):
+            values = columns.get(column)
+            if values is None and column == 'uid':
+                values = columns.get('user')
+            if values is None or not len(values):
+                row_ids = np.zeros(0, dtype=np.int64)
+            else:
+                uniq, inverse = np.unique(values, return_inverse=True)
+                lookup = np.empty(len(uniq), dtype=np.int64)
+                for i, value in enumerate(uniq.tolist()):
+                    gid = value_ids.get(value)
+                    if gid is None:
+                        name = group_of(value)
+                        if name is None:
+                            gid = -1
+                        else:
+                            gid = name_ids.get(name)
+                            if gid is None:
+                                gid = name_ids[name] = len(names)
+                                names.append(name)
+                        value_ids[value] = gid
+                    lookup[i] = gid
+                row_ids = lookup[inverse]
+                row_ids = row_ids[row_ids >= 0]
+            bins = np.bincount(row_ids)
+            seen = np.flatnonzero(bins)
+            keys.append(key)
+            ids.append(seen)
+            counts.append(bins[seen])
+        return PSGroupPartial(keys, names, ids, counts)
+
+    def traverse_groups(self, by=GROUP_BY_CMD, processes=1):
+        """Count the ps lines of every snapshot per command, user or regex
+
+        Parameters
+        ----------
+        by : string or compiled regex, default 'cmd'
+            'cmd' groups by command name (see psparse.command_name),
+            'user' by the UID/USER column; any other value is a regex
+            searched in the whole command line, grouping by its first
+            group, or by the whole match when it has none. Lines it does
+            not match are not counted.
+
+        processes : int, default 1
+            number of worker processes, as in traverse_dir
+
+        Returns
+        -------
+        names : list of string
+            the groups, in order of first appearance; the rows of
+            self.group_counts, whose columns follow self.group_keys
+
+        Examples
+        --------
+        >>> osw.traverse_groups(by='cmd')
+        >>> for name in osw.top_groups(5):
+        ...     series = osw.get_group_series(name)
+        >>> osw.traverse_groups(by=r'^(ora_[a-z]+)_')
+
+        Every file is read once whatever the number of groups. The lines
+        a file holds before its first zzz marker are not counted here.
+        """
+        file_list = self._list_files()
+        if processes == 1:
+            partials = (self._group_data_from_one_file(f, by) for f in file_list)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(processes)
+            args = [(self.path, self.category, f, by) for f in file_list]
+            partials = pool.imap(_group_file_worker, args)
+
+        name_ids = {}
+        keys = []
+        columns, ids, counts = [], [], []
+        try:
+            for partial in partials:
+                remap = np.array([name_ids.setdefault(n, len(name_ids))
+                                  for n in partial.names], dtype=np.int64)
+                for key, pids, pcounts in zip(partial.keys, partial.ids,
+                                              partial.counts):
+                    if not keys or keys[-1] != key:
+                        """ A snapshot split over two files keeps one column """
+                        keys.append(key)
+                    columns.append(np.full(len(pids), len(keys) - 1, dtype=np.int64))
+                    ids.append(remap[pids])
+                    counts.append(pcounts)
+            if pool is not None:
+                pool.close()
+        except:
+            if pool is not None:
+                pool.terminate()
+            raise
+        finally:
+            if pool is not None:
+                pool.join()
+
+        names = [None] * len(name_ids)
+        for name, gid in name_ids.items():
+            names[gid] = name
+        matrix = np.zeros((len(names), len(keys)), dtype=np.int32)
+        if ids:
+            np.add.at(matrix, (np.concatenate(ids), np.concatenate(columns)),
+                      np.concatenate(counts))
+        self.group_names = names
+        self.group_keys = keys
+        self.group_counts = matrix
+        return names
+
+    def get_group_series(self, name):
+        """Return the counts of one group of traverse_groups as a TimeSeries"""
+        row = self.group_names.index(name)
+        return TimeSeries(keys_to_epoch(self.group_keys), self.group_counts[row])
+
+    def top_groups(self, n=10):
+        """Names of the n groups of traverse_groups with the highest peak count"""
+        if self.group_counts is None or not len(self.group_names):
+            return []
+        peaks = self.group_counts.max(axis=1)
+        order = np.argsort(-peaks, kind='mergesort')[:n]
+        return [self.group_names[i] for i in order]
+
+    def index_dir(self):
+        """Build or refresh the zzz index of every plain osw file
+
+        Returns
+        -------
+        indexes : dict
+            filepath: OSWIndex, for the files that are not compressed
+        """
+        indexes = {}
+        for filepath in self._list_files():
+            if self._compression(filepath) is None:
+                indexes[filepath] = self._zzz_index(filepath)
+        return indexes
+
+    def _zzz_index(self, filepath):
+        """Loaded OSWIndex of a plain file, kept in zzz_index_dir if set"""
+        if self.zzz_index_dir is None:
+            return OSWIndex(filepath).load()
+        return OSWIndex(filepath, index_path(filepath, self.zzz_index_dir)).load()
+
+    def _file_hour(self, filepath):
+        """Epoch seconds of the hour in an osw file name, or None
+
+        e.g. 'acmsdbv2024_ps_16.10.17.0900.dat.gz' -> 2016-10-17 09:00:00
+        """
+        m = self.hour_pattern.match(os.path.basename(filepath))
+        if m is None:
+            return None
+        yy, mm, dd, hh, mi = [int(g) for g in m.groups()]
+        return calendar.timegm((2000 + yy, mm, dd, hh, mi, 0))
+
+    def _head_lines(self, filepath):
+        """Yield the lines of a file up to and including its first zzz"""
+        for line in self._readfile(filepath):
+            yield line
+            if 'zzz' in line:
+                return
+
+    def _query_partial(self, filepath, start, end):
+        """PSPartial of the snapshots of one file that may be in range
+
+        Plain files are read through their zzz index, so only the blocks
+        in [start, end) are read; compressed files are read whole.
+        """
+        if self._compression(filepath) is not None:
+            return self._analyse_data_from_one_file(filepath), True
+        index = self._zzz_index(filepath)
+        if not index.offsets:
+            return self._analyse_data_from_one_file(filepath), True
+        i, j = index.find(start, end)
+        partial = self._analyse_ps_data(index.read_blocks(i, j))
+        return partial, j == len(index.offsets)
+
+    def query(self, start=None, end=None):
+        """Return the ps counts of the snapshots between start and end
+
+        Parameters
+        ----------
+        start, end : string or datetime, default None
+            'YYYY-MM-DD HH:MM:SS' like the snapshot keys, or a naive
+            datetime; a snapshot is returned if start <= timestamp < end.
+            None leaves that side open.
+
+        Returns
+        -------
+        series : TimeSeries
+            ps counts, like get_ps_series(). The series of this OSWData
+            is not changed.
+
+        Files are pruned by the hour in their name before being opened,
+        assuming each one holds the snapshots up to the hour of the next
+        file, so a narrow window only reads a few files.
+        """
+        start = _query_bound(start)
+        end = _query_bound(end)
+        file_list = self._list_files()
+        hours = [self._file_hour(f) for f in file_list]
+
+        selected = []
+        for i, filepath in enumerate(file_list):
+            first = hours[i]
+            last = None
+            for h in hours[i + 1:]:
+                if h is not None:
+                    last = h
+                    break
+            if first is not None and end is not None and first >= end:
+                continue
+            if first is not None and last is not None and start is not None \
+                    and last <= start:
+                continue
+            selected.append(i)
+
+        run = OSWData(path=self.path, category=self.category,
+                      zzz_index_dir=self.zzz_index_dir)
+        for n, i in enumerate(selected):
+            partial, to_eof = run._query_partial(file_list[i], start, end)
+            run._merge_ps_partial(partial)
+            following = i + 1
+            if to_eof and n == len(selected) - 1 and following < len(file_list):
+                """ The last snapshot may straddle into the next file """
+                head = run._analyse_ps_data(run._head_lines(file_list[following]))
+                run._merge_ps_partial(head._replace(keys=[], counts=[]))
+
+        return run.get_ps_series().slice(start, end)
+
+    def traverse_new(self, checkpoint):
+        """Analyse only the osw data appended since the previous call
+
+        Parameters
+        ----------
+        checkpoint : string
+            path of the json file keeping the byte offset reached in every
+            osw file and the last snapshot handed out, created on first use
+
+        Returns
+        -------
+        series : TimeSeries
+            ps counts of the snapshots completed since the previous call,
+            also merged into the series of get_ps_series(). The newest
+            snapshot is held back until the next zzz arrives, since
+            OSWatcher may still be appending to it.
+        """
+        state = _load_checkpoint(checkpoint)
+        last_key = state['last_key']
+        file_list = self._list_files()
+        run = OSWData(path=self.path, category=self.category,
+                      zzz_index_dir=self.zzz_index_dir)
+        entries = {}
+        pending = None
+
+        for i, filepath in enumerate(file_list):
+            name = os.path.basename(filepath)
+            st = os.stat(filepath)
+            entry = state['files'].get(name, {})
+            offset = entry.get('offset', 0)
+            if entry.get('size') == st.st_size and offset == st.st_size:
+                entries[name] = entry
+                continue
+
+            newest = (i == len(file_list) - 1)
+            compressed = self._compression(filepath) is not None
+            pos = {}
+            if compressed or st.st_size < offset:
+                offset = 0
+            if compressed:
+                lines = self._readfile(filepath)
+                pos['end'] = st.st_size
+            else:
+                lines = self._tailfile(filepath, offset, pos, complete=not newest)
+            partial = run._analyse_ps_data(lines)
+            if offset > 0:
+                """ The head was counted when the previous read stopped """
+                partial = partial._replace(head=0)
+            if newest and not partial.keys:
+                """ Wait for a zzz before consuming the newest file """
+                if entry:
+                    entries[name] = entry
+                continue
+
+            run._merge_ps_partial(partial)
+            entries[name] = {'size': st.st_size, 'mtime': st.st_mtime,
+                             'offset': pos['end']}
+            if partial.keys:
+                pending = (name, pos.get('zzz', 0))
+
+        """ Re-read the snapshot held back from its zzz line next time """
+        if pending is not None:
+            entries[pending[0]]['offset'] = pending[1]
+
+        series = run.get_ps_series()
+        keep = np.ones(len(series), dtype=bool)
+        if run._last_key is not None:
+            keep &= series.timestamps != key_to_epoch(run._last_key)
+        if last_key is not None:
+            keep &= series.timestamps > key_to_epoch(last_key)
+        series = TimeSeries(series.timestamps[keep], series.values[keep])
+        if len(series):
+            state['last_key'] = epoch_to_key(series.timestamps[-1])
+        state['files'] = entries
+        _save_checkpoint(checkpoint, state)
+
+        if len(series):
+            self._ps_parts.append((series.timestamps, series.values.astype(np.int64)))
+        return series
 
-    def traverse_dir(self):
-        file_list = os.listdir(self.path)
-        for file in file_list:
-            filepath = os.path.join('%s/%s' % (self.path, file))
-            self._analyse_data_from_one_file(filepath)
-    
     def get_ps_dict(self):
-        return self.ps_dict
+        """Return get_ps_series() as a {'YYYY-MM-DD HH:MM:SS': count} dict
+
+        The counts are ints, as they were before the series was kept in
+        arrays; the TimeSeries holds them as floats.
+        """
+        series = self.get_ps_series()
+        return dict(zip(series.keys(), series.values.astype(np.int64).tolist()))
+
+    def get_ps_series(self):
+        """Return the ps counts as a TimeSeries sorted by timestamp
+
+        The per-file arrays are joined as merged; they only need a sort
+        when the files are not in timestamp order, and a timestamp seen
+        twice keeps its last count.
+        """
+        if not self._ps_parts:
+            return TimeSeries()
+        timestamps = np.concatenate([part[0] for part in self._ps_parts])
+        counts = np.concatenate([part[1] for part in self._ps_parts])
+        if np.all(timestamps[1:] > timestamps[:-1]):
+            return TimeSeries(timestamps, counts)
+        return TimeSeries().merge(TimeSeries(timestamps, counts, sort=False))
+
+
+def _analyse_file_worker(args):
+    """Process pool entry point, returns the PSPartial of one file"""
+    path, category, filepath = args
+    osw = OSWData(path=path, category=category)
+    return osw._analyse_data_from_one_file(filepath)
+
+
+def _group_file_worker(args):
+    """Process pool entry point, returns the PSGroupPartial of one file"""
+    path, category, filepath, by = args
+    osw = OSWData(path=path, category=category)
+    return osw._group_data_from_one_file(filepath, by)
+
+
+def _query_bound(bound):
+    """Return the epoch seconds of a query bound"""
+    if bound is None:
+        return None
+    if isinstance(bound, datetime.datetime):
+        bound = bound.strftime("%Y-%m-%d %H:%M:%S")
+    return key_to_epoch(bound)
+
+
+def _load_checkpoint(checkpoint):
+    if not os.path.exists(checkpoint):
+        return {'version': 1, 'last_key': None, 'files': {}}
+    with open(checkpoint) as fp:
+        state = json.load(fp)
+    if state.get('version') != 1:
+        raise ValueError("Unknown checkpoint version in " + checkpoint)
+    return state
+
+
+def _save_checkpoint(checkpoint, state):
+    tmp = checkpoint + ".tmp"
+    with open(tmp, "w") as fp:
+        json.dump(state, fp, indent=1, sort_keys=True)
+    os.rename(tmp, checkpoint)
 
 
 def main():
@@ -385,7 +1024,7 @@ def main():
     #path = 'oswps'
     osw = OSWData(path=path, category=PS)
     osw.traverse_dir()
-    ps_dict = osw.get_ps_dict()
+    series = osw.get_ps_series()
 
 if __name__ == '__main__':
     main()
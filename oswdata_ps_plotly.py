@@ -9,8 +9,9 @@ import calendar
 import datetime
 import time
 import collections
-import plotly.plotly as py
-import plotly.graph_objs as go
+from timeparse import keys_to_epoch
+from timeseries import TimeSeries
+from plotrender import plot_series
 
 #from certifi import __main__
 
@@ -384,24 +385,9 @@ class OSWData(object):
         return self.ps_dict
 
 def plot_diagram(keys, values, filename):
-    normal_color = dict(color='#FF0000')
-    abnomal_color = dict(color='#0000FF')
-    trace = go.Scatter(
-        x = keys,
-        y = values,
-        mode = 'lines',
-        marker=normal_color
-    )
-    
-    trace2 = go.Scatter(
-        x = keys[:100],
-        y = values[:100],
-        mode = 'markers',
-        marker=abnomal_color
-    )
-
-    data = [trace, trace2]
-    py.iplot(data, filename=filename)
+    series = TimeSeries(keys_to_epoch(keys), values)
+    head = TimeSeries(series.timestamps[:100], series.values[:100])
+    plot_series(series, head, filename, normal_color='#FF0000', anomaly_color='#0000FF')
 
 def main():
     path = 'oswps'
@@ -411,7 +397,7 @@ def main():
     ps_dict_unsorted = osw.get_ps_dict()
     ps_od = collections.OrderedDict(sorted(ps_dict_unsorted.items()))
     keys, values = zip(*ps_od.items())
-    plot_diagram(keys, values, 'ps_count_crond_problems')
+    plot_diagram(keys, values, 'ps_count_crond_problems.html')
     
 
 if __name__ == '__main__':
@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from optparse import OptionParser
+import os
+import sys
+import bz2
+import gzip
+import json
+import time
+import random
+
+from timeparse import key_to_epoch, epoch_to_key
+
+"""
+    NAME
+      oswgen.py
+
+    DESCRIPTION
+      Generator of synthetic OSWatcher ps archives.
+
+    NOTES
+      Writes one file per hour, named and laid out as the files of oswps/:
+
+        acmsdbv2024_ps_16.10.17.0900.dat
+          Linux    OSW v2.1.1
+          zzz ***Mon Oct 17 09:00:41 UTC 2016
+          F S UID        PID  PPID  C PRI  NI ADDR SZ WCHAN  STIME TTY          TIME CMD
+          4 S root         1     0  0  80   0 -  2590 poll_s  2015 ?        00:08:26 init [3]
+
+      Each snapshot lists kernel threads, system daemons, the background
+      processes of a database and its sessions; the number of sessions
+      drifts around its mean from one snapshot to the next. A spike adds
+      a burst of crond processes for a few snapshots, as in the
+      ps_count_crond_problems example. The files are written plain,
+      gzipped or bzip2ed in turn from the formats list, and with several
+      hosts each host gets its own subdirectory, since an OSWData reads
+      one host per directory.
+
+      The parameters, the spike timestamps and the sizes of the archive
+      are saved to oswgen.json in the output directory.
+
+"""
+
+"""Global Variables"""
+PS_HEADER = "F S UID        PID  PPID  C PRI  NI ADDR SZ WCHAN  STIME TTY          TIME CMD"
+BANNER = "Linux    OSW v2.1.1"
+""" Written next to the generated files """
+METADATA_FILE = "oswgen.json"
+FORMATS = {"dat": "", "gz": ".gz", "bz2": ".bz2"}
+DEFAULTS = {"hosts": ["acmsdbv2024"], "start": "2016-10-17 09:00:00", "hours": 24,
+            "interval": 60, "offset": 41, "processes": 372, "jitter": 10,
+            "spikes": 0, "spike_size": 100, "spike_length": 5,
+            "formats": ["dat"], "sid": "BLOGSA2", "seed": 0}
+KERNEL_THREADS = ["kthreadd", "migration/%d", "ksoftirqd/%d", "watchdog/%d",
+                  "events/%d", "kblockd/%d", "kintegrityd/%d", "ata/%d"]
+DAEMONS = ["/sbin/udevd -d", "auditd", "/sbin/rsyslogd -i /var/run/syslogd.pid -c 5",
+           "irqbalance --pid=/var/run/irqbalance.pid", "/usr/sbin/sshd", "ntpd -u ntp:ntp -p /var/run/ntpd.pid -g",
+           "crond", "/usr/sbin/atd", "/sbin/mingetty /dev/tty1", "/bin/sh ./OSWatcher.sh 60 48"]
+BACKGROUND = ["pmon", "psp0", "vktm", "gen0", "diag", "ping", "acms", "dia0", "lmon",
+              "lmd0", "lms0", "lms1", "rms0", "lmhb", "mman", "dbw0", "lgwr", "ckpt",
+              "smon", "reco", "mmon", "mmnl"]
+
+
+# -----------------------------------------------------------------------
+# PSTable class
+
+class PSTable(object):
+    """Process table of one synthetic host
+
+    Parameters
+    ----------
+    processes : int
+        mean number of ps lines of a snapshot
+
+    jitter : int
+        standard deviation of the step of the session count between two
+        snapshots
+
+    sid : string
+        database name in the oracle process names
+
+    rng : random.Random
+    """
+
+    def __init__(self, processes, jitter, sid, rng):
+        self.rng = rng
+        self.jitter = jitter
+        self.sid = sid
+        self.next_pid = 1
+        self.cpus = 4
+        fixed = [self._line(4, "root", 0, 2590, "poll_s", "init [3]")]
+        kthreadd = self.next_pid
+        for name in KERNEL_THREADS:
+            for cpu in range(self.cpus if "%d" in name else 1):
+                cmd = "[%s]" % (name % cpu if "%d" in name else name)
+                fixed.append(self._line(1, "root", kthreadd if cmd != "[kthreadd]" else 0,
+                                        0, "worker", cmd))
+        self.crond = self.next_pid
+        for cmd in DAEMONS:
+            fixed.append(self._line(5, "root", 1, rng.randint(1000, 30000), "poll_s", cmd))
+        for name in BACKGROUND:
+            fixed.append(self._line(0, "oracle", 1, rng.randint(1108000, 1114000), "semtim",
+                                    "ora_%s_%s" % (name, sid)))
+        self.fixed = fixed
+        self.mean = max(processes - len(fixed), 0)
+        self.sessions = [self._session() for _ in range(self.mean)]
+
+    def _line(self, flags, user, ppid, size, wchan, cmd, stime=" 2015", cpu=None):
+        """Columns of a ps line, the cpu time last so it can tick"""
+        pid = self.next_pid
+        self.next_pid = pid + 1 if pid < 32767 else 300
+        if cpu is None:
+            cpu = self.rng.randint(0, 40000)
+        return ["%d S %-8s %5d %5d  0  80   0 - %5d %-6s %5s ?        " % (
+            flags, user, pid, ppid, size, wchan, stime), cpu, " " + cmd]
+
+    def _session(self):
+        return self._line(0, "oracle", 1, self.rng.randint(1110000, 1111000), "sk_wai",
+                          "oracle%s (LOCAL=NO)" % self.sid, stime="08:37", cpu=0)
+
+    def step(self, extra=0):
+        """Move the table to the next snapshot and return its ps lines
+
+        extra crond processes are added on top, for a spike.
+        """
+        rng = self.rng
+        target = int(round(len(self.sessions) + rng.gauss(0, self.jitter) +
+                           0.1 * (self.mean - len(self.sessions))))
+        target = max(target, 0)
+        while len(self.sessions) > target:
+            self.sessions.pop(rng.randrange(len(self.sessions)))
+        while len(self.sessions) < target:
+            self.sessions.append(self._session())
+        lines = []
+        for line in self.fixed + self.sessions:
+            if rng.random() < 0.05:
+                line[1] += 1
+            lines.append("%s%s%s" % (line[0], _cpu_time(line[1]), line[2]))
+        for _ in range(extra):
+            line = self._line(1, "root", self.crond, 29000, "pipe_w", "crond",
+                              stime="09:01", cpu=0)
+            lines.append("%s%s%s" % (line[0], _cpu_time(line[1]), line[2]))
+        return lines
+
+
+def _cpu_time(seconds):
+    """TIME column of ps, [dd-]hh:mm:ss"""
+    days, rest = divmod(seconds, 86400)
+    text = "%02d:%02d:%02d" % (rest // 3600, rest // 60 % 60, rest % 60)
+    return "%d-%s" % (days, text) if days else text
+
+
+def _zzz(epoch):
+    return "zzz ***" + time.strftime("%a %b %d %H:%M:%S UTC %Y", time.gmtime(epoch))
+
+
+def _open(filename, fmt):
+    if fmt == "gz":
+        return gzip.open(filename, "wb")
+    if fmt == "bz2":
+        return bz2.BZ2File(filename, "wb")
+    return open(filename, "wb")
+
+
+def _spike_starts(rng, snapshots, spikes, length):
+    """Snapshot indices where the spikes start, apart from each other"""
+    if spikes <= 0 or snapshots <= length:
+        return []
+    slots = list(range(0, snapshots - length, length + 1))
+    return sorted(rng.sample(slots, min(spikes, len(slots))))
+
+
+def generate_host(path, host, params, rng):
+    """Write the archive of one host to the path directory
+
+    Returns
+    -------
+    info : dict
+        files, snapshots, bytes on disk, raw (uncompressed) bytes and the
+        keys of the snapshots of every spike
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    start = key_to_epoch(params["start"])
+    start -= start % 3600
+    interval = params["interval"]
+    per_hour = max(3600 // interval, 1)
+    snapshots = per_hour * params["hours"]
+    table = PSTable(params["processes"], params["jitter"], params["sid"], rng)
+    starts = _spike_starts(rng, snapshots, params["spikes"], params["spike_length"])
+    spiking = set(i + k for i in starts for k in range(params["spike_length"]))
+    formats = params["formats"]
+    info = {"files": 0, "snapshots": snapshots, "bytes": 0, "raw_bytes": 0,
+            "spikes": [[epoch_to_key(start + params["offset"] + (i + k) * interval)
+                        for k in range(params["spike_length"])] for i in starts]}
+
+    for hour in range(params["hours"]):
+        epoch = start + hour * 3600
+        fmt = formats[hour % len(formats)]
+        name = "%s_ps_%s.dat%s" % (host, time.strftime("%y.%m.%d.%H00", time.gmtime(epoch)),
+                                   FORMATS[fmt])
+        filename = os.path.join(path, name)
+        raw = 0
+        with _open(filename, fmt) as f:
+            block = BANNER + "\n"
+            for i in range(hour * per_hour, (hour + 1) * per_hour):
+                extra = params["spike_size"] if i in spiking else 0
+                lines = table.step(extra)
+                block += "%s\n%s\n%s\n" % (_zzz(epoch + params["offset"] + (i - hour * per_hour) * interval),
+                                           PS_HEADER, "\n".join(lines))
+                data = block.encode("ascii")
+                f.write(data)
+                raw += len(data)
+                block = ""
+        info["files"] += 1
+        info["raw_bytes"] += raw
+        info["bytes"] += os.path.getsize(filename)
+    return info
+
+
+def generate(path, **params):
+    """Write a synthetic archive for every host and return its metadata
+
+    Parameters
+    ----------
+    path : string
+        output directory; with several hosts, each gets a subdirectory
+        named after it
+
+    hosts : list of string, default ['acmsdbv2024']
+        host name prefixes of the file names
+
+    start : string, default '2016-10-17 09:00:00'
+        'YYYY-MM-DD HH:MM:SS' of the first file, rounded down to the hour
+
+    hours : int, default 24
+        files per host, one per hour
+
+    interval, offset : int, default 60, 41
+        seconds between two snapshots, and of the first one past the hour
+
+    processes, jitter : int, default 372, 10
+        mean ps lines per snapshot, step of the drift of the session count
+
+    spikes, spike_size, spike_length : int, default 0, 100, 5
+        number of spikes, crond processes they add, snapshots they last
+
+    formats : list of string, default ['dat']
+        'dat', 'gz' or 'bz2', given to the files of each host in turn
+
+    seed : int, default 0
+
+    Examples
+    --------
+    >>> meta = generate('/tmp/oswps.week', hours=168, spikes=4,
+    ...                 formats=['dat', 'gz', 'bz2'])
+    >>> OSWData(path='/tmp/oswps.week', category='ps').traverse_dir()
+    """
+    unknown = set(params) - set(DEFAULTS)
+    if unknown:
+        raise ValueError("Unknown parameters: " + ", ".join(sorted(unknown)))
+    params = dict(DEFAULTS, **params)
+    for fmt in params["formats"]:
+        if fmt not in FORMATS:
+            raise ValueError("Unknown format %r, expected one of %s"
+                             % (fmt, ", ".join(sorted(FORMATS))))
+    if params["interval"] <= 0 or params["interval"] > 3600:
+        raise ValueError("The interval must be between 1 and 3600 seconds")
+
+    rng = random.Random(params["seed"])
+    hosts = {}
+    for host in params["hosts"]:
+        host_path = path if len(params["hosts"]) == 1 else os.path.join(path, host)
+        hosts[host] = generate_host(host_path, host, params, rng)
+    meta = {"params": params, "hosts": hosts}
+    with open(os.path.join(path, METADATA_FILE), "w") as fp:
+        json.dump(meta, fp, indent=1, sort_keys=True)
+    return meta
+
+
+def load_metadata(path):
+    """Return the oswgen.json of a generated archive, None if there is none"""
+    filename = os.path.join(path, METADATA_FILE)
+    if not os.path.exists(filename):
+        return None
+    with open(filename) as fp:
+        return json.load(fp)
+
+
+if __name__ == "__main__":
+    helpString = (
+        "\n%prog [options] outputDir"
+        "\n%prog --help"
+        "\n"
+        "\nWrites a synthetic OSWatcher ps archive to outputDir."
+    )
+    parser = OptionParser(helpString)
+    parser.add_option("--hosts", default=",".join(DEFAULTS["hosts"]),
+                      help="Comma separated host name prefixes. (default: %default)")
+    parser.add_option("--start", default=DEFAULTS["start"],
+                      help="Hour of the first file, 'YYYY-MM-DD HH:MM:SS'. (default: %default)")
+    parser.add_option("--hours", default=DEFAULTS["hours"], type=int,
+                      help="Hourly files per host. [default: %default]")
+    parser.add_option("--interval", default=DEFAULTS["interval"], type=int,
+                      help="Seconds between snapshots. [default: %default]")
+    parser.add_option("--processes", default=DEFAULTS["processes"], type=int,
+                      help="Mean ps lines per snapshot. [default: %default]")
+    parser.add_option("--jitter", default=DEFAULTS["jitter"], type=int,
+                      help="Drift of the session count per snapshot. [default: %default]")
+    parser.add_option("--spikes", default=DEFAULTS["spikes"], type=int,
+                      help="Spikes of crond processes to inject. [default: %default]")
+    parser.add_option("--spikeSize", default=DEFAULTS["spike_size"], type=int,
+                      help="Processes added by a spike. [default: %default]")
+    parser.add_option("--spikeLength", default=DEFAULTS["spike_length"], type=int,
+                      help="Snapshots a spike lasts. [default: %default]")
+    parser.add_option("--formats", default=",".join(DEFAULTS["formats"]),
+                      help="Comma separated mix of dat, gz and bz2 used in turn. (default: %default)")
+    parser.add_option("--seed", default=DEFAULTS["seed"], type=int,
+                      help="Random seed. [default: %default]")
+    options, args = parser.parse_args(sys.argv[1:])
+    if len(args) != 1:
+        parser.error("expected an output directory")
+
+    meta = generate(args[0], hosts=options.hosts.split(","), start=options.start,
+                    hours=options.hours, interval=options.interval,
+                    processes=options.processes, jitter=options.jitter,
+                    spikes=options.spikes, spike_size=options.spikeSize,
+                    spike_length=options.spikeLength,
+                    formats=options.formats.split(","), seed=options.seed)
+    for host, info in sorted(meta["hosts"].items()):
+        print("%s: %d files, %d snapshots, %.1f MB (%.1f MB uncompressed), %d spikes" % (
+            host, info["files"], info["snapshots"], info["bytes"] / 1e6,
+            info["raw_bytes"] / 1e6, len(info["spikes"])))
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import plotly.offline
+import plotly.graph_objs as go
+
+from timeparse import epoch_to_key
+
+"""
+    NAME
+      plotrender.py
+
+    DESCRIPTION
+      Offline plotly rendering of a series and its anomalies.
+
+    NOTES
+      plot_series() writes a self-contained html page, plotly.js included,
+      so nothing goes to the plotly cloud and the page opens without
+      network access. The value line is decimated to about max_points
+      points with largest-triangle-three-buckets (LTTB), which keeps the
+      peaks and dips a plain stride would drop; the anomalies are points
+      of the line too and are always kept, and their markers are drawn
+      from the full anomaly series. A month of one-minute snapshots
+      (43k points) is drawn from about 90 KB of data instead of 1.9 MB.
+      plotly.js (about 3 MB) is not embedded: it is written once as
+      plotly.min.js next to the pages, which load it from there, so they
+      still open without network access. include_plotlyjs=True embeds
+      it again, 'cdn' loads it from the plotly CDN instead.
+
+"""
+
+"""Global Variables"""
+""" Points of the value line after decimation """
+MAX_POINTS = 2000
+""" Lines longer than this are drawn with WebGL """
+WEBGL_POINTS = 20000
+NORMAL_COLOR = '#0000FF'
+ANOMALY_COLOR = '#FF0000'
+
+
+def lttb(x, y, threshold):
+    """Indices of the threshold points LTTB keeps out of x, y
+
+    The first and last points are kept; the points in between are split
+    in threshold - 2 buckets, and each bucket keeps the point forming the
+    largest triangle with the point kept before it and the mean of the
+    next bucket. Fewer points than threshold are all kept.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    bounds = (np.arange(threshold - 1) * (n - 2.0) / (threshold - 2)).astype(np.int64) + 1
+    bounds[-1] = n - 1
+    sums_x = np.concatenate([[0.0], np.cumsum(x)])
+    sums_y = np.concatenate([[0.0], np.cumsum(y)])
+    sizes = bounds[1:] - bounds[:-1]
+    """ Mean of the bucket after each bucket, the last point after the last """
+    next_x = np.append(((sums_x[bounds[1:]] - sums_x[bounds[:-1]]) / sizes)[1:], x[-1])
+    next_y = np.append(((sums_y[bounds[1:]] - sums_y[bounds[:-1]]) / sizes)[1:], y[-1])
+
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0] = 0
+    kept[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = bounds[i], bounds[i + 1]
+        area = np.abs((x[a] - next_x[i]) * (y[lo:hi] - y[a]) -
+                      (x[a] - x[lo:hi]) * (next_y[i] - y[a]))
+        a = lo + int(np.argmax(area))
+        kept[i + 1] = a
+    return kept
+
+
+def decimate(series, anomalies=None, max_points=MAX_POINTS):
+    """Indices of the points of series to draw
+
+    LTTB of series down to max_points, plus every point whose timestamp
+    is in anomalies; max_points of 0 keeps everything.
+    """
+    if not max_points:
+        return np.arange(len(series))
+    kept = lttb(series.timestamps, series.values, max_points)
+    if anomalies is not None and len(anomalies):
+        found = np.flatnonzero(np.isin(series.timestamps, anomalies.timestamps))
+        kept = np.union1d(kept, found)
+    return kept
+
+
+def _keys(timestamps):
+    return [epoch_to_key(t) for t in timestamps.tolist()]
+
+
+def plot_series(series, anomalies, filename, max_points=MAX_POINTS, title=None,
+                normal_color=NORMAL_COLOR, anomaly_color=ANOMALY_COLOR,
+                include_plotlyjs='directory'):
+    """Write a series and its anomalies to an html file
+
+    Parameters
+    ----------
+    series, anomalies : TimeSeries
+        the values, drawn as a line, and the anomalies, drawn as markers
+
+    filename : string
+        html file to write
+
+    max_points : int, default MAX_POINTS
+        decimate the line to about this many points, 0 to draw them all
+
+    include_plotlyjs : bool or string, default 'directory'
+        where the page gets plotly.js from, passed on to
+        plotly.offline.plot: 'directory' for a plotly.min.js next to it
+
+    Returns
+    -------
+    filename : string
+    """
+    kept = decimate(series, anomalies, max_points)
+    line = go.Scattergl if len(kept) > WEBGL_POINTS else go.Scatter
+    data = [
+        line(x=_keys(series.timestamps[kept]), y=series.values[kept], mode='lines',
+             name='value', marker=dict(color=normal_color)),
+        go.Scatter(x=_keys(anomalies.timestamps), y=anomalies.values,
+                   mode='markers', name='anomaly', marker=dict(color=anomaly_color)),
+    ]
+    figure = go.Figure(data=data, layout=go.Layout(title=title or filename))
+    plotly.offline.plot(figure, filename=filename, auto_open=False,
+                        include_plotlyjs=include_plotlyjs, show_link=False)
+    return filename
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import numpy as np
+
+"""
+    NAME
+      psparse.py
+
+    DESCRIPTION
+      Columnar parser of the ps snapshots of an osw ps file.
+
+    NOTES
+      A snapshot block is the text from one 'zzz ***' marker to the next:
+
+        zzz ***Mon Oct 17 09:00:41 UTC 2016
+        F S UID        PID  PPID  C PRI  NI ADDR SZ WCHAN  STIME TTY          TIME CMD
+        4 S root         1     0  0  80   0 -  2590 poll_s  2015 ?        00:08:26 init [3]
+
+      ps pads the columns to the header, but a wide value (e.g. an SZ of
+      1110857) pushes the rest of the line to the right, so the columns
+      are located by token position in the header instead of by byte
+      offset. The whole block is tokenized at once with numpy: no python
+      code runs per ps line.
+
+"""
+
+"""Global Variables"""
+
+""" Header name -> kind of the columns that can be extracted """
+COLUMN_KINDS = {
+    'UID': 'name', 'USER': 'name',
+    'PID': 'int', 'PPID': 'int', 'SZ': 'int', 'RSS': 'int', 'VSZ': 'int',
+    'C': 'int', 'NI': 'int', 'PRI': 'int',
+    'TIME': 'time',
+    'CMD': 'cmd', 'COMMAND': 'cmd',
+}
+""" Columns extracted by default """
+DEFAULT_COLUMNS = ('UID', 'USER', 'PID', 'PPID', 'SZ', 'RSS', 'VSZ', 'TIME',
+                   'CMD', 'COMMAND')
+""" Widest token kept per kind; longer names and commands are cut unless
+parse_ps_block is given a width of None """
+NAME_WIDTH = 16
+INT_WIDTH = 12
+CMD_WIDTH = 64
+
+_SPACE = np.zeros(256, dtype=bool)
+_SPACE[[9, 10, 13, 32]] = True
+
+"""
+Columns of one snapshot, in ps line order
+
+key     : snapshot timestamp, 'YYYY-MM-DD HH:MM:SS' like the OSWData keys
+columns : dict of lowercase header name -> ndarray, e.g. 'pid' int64,
+          'uid' S16, 'time' int64 cpu seconds, 'cmd' S64
+"""
+PSSnapshot = collections.namedtuple('PSSnapshot', ['key', 'columns'])
+
+
+def _gather(buf, starts, ends, width, right=False):
+    """Return the tokens buf[starts:ends] as an (n, width) uint8 matrix
+
+    Tokens are left aligned and zero padded, or right aligned when right
+    is set; longer tokens are cut to width, a width of None keeps them
+    whole. The matrix is only as wide as the longest token, to keep the
+    work proportional to the text.
+    """
+    longest = int((ends - starts).max()) if len(starts) else 1
+    if width is None:
+        width = longest
+    width = max(1, min(width, longest))
+    offsets = np.arange(width)
+    if right:
+        idx = ends[:, None] - width + offsets
+        mask = idx >= starts[:, None]
+    else:
+        idx = starts[:, None] + offsets
+        mask = idx < ends[:, None]
+    idx = np.clip(idx, 0, len(buf) - 1)
+    return np.where(mask, buf[idx], 0).astype(np.uint8)
+
+
+def _to_int(chars):
+    """Decimal value of each row of a right aligned _gather matrix
+
+    Characters other than digits count as 0 in their position, so '-'
+    reads as 0; a '-' before the digits makes the value negative ('-40'
+    for a real-time PRI).
+    """
+    digits = chars.astype(np.int64) - 48
+    isdigit = (digits >= 0) & (digits <= 9)
+    weights = 10 ** np.arange(chars.shape[1] - 1, -1, -1, dtype=np.int64)
+    value = np.where(isdigit, digits, 0).dot(weights)
+    negative = ((chars == 45) & ~np.cumsum(isdigit, axis=1).astype(bool)).any(axis=1)
+    return np.where(negative, -value, value)
+
+
+def _to_strings(chars):
+    return np.ascontiguousarray(chars).view('S%d' % chars.shape[1]).ravel()
+
+
+def _time_to_seconds(buf, starts, ends):
+    """'[DD-]hh:mm:ss' tokens -> seconds"""
+    chars = _gather(buf, starts, ends, 8, right=True)
+    if chars.shape[1] < 8:
+        chars = np.hstack([np.zeros((len(chars), 8 - chars.shape[1]), np.uint8),
+                           chars])
+    seconds = (3600 * _to_int(chars[:, 0:2]) + 60 * _to_int(chars[:, 3:5]) +
+               _to_int(chars[:, 6:8]))
+    has_days = (ends - starts) > 9
+    days = _to_int(_gather(buf, starts, np.maximum(ends - 9, starts),
+                           INT_WIDTH, right=True))
+    return seconds + np.where(has_days, 86400 * days, 0)
+
+
+def parse_ps_block(block, names=DEFAULT_COLUMNS, name_width=NAME_WIDTH,
+                   cmd_width=CMD_WIDTH):
+    """Parse one zzz block into columns
+
+    Parameters
+    ----------
+    block : bytes
+        text of the block, starting at its 'zzz ***' marker line
+
+    names : sequence of string, default DEFAULT_COLUMNS
+        header names of the columns to extract, among COLUMN_KINDS
+
+    name_width, cmd_width : int or None, default NAME_WIDTH, CMD_WIDTH
+        bytes kept of the user names and of the commands; None keeps the
+        whole text, as wide as the longest one of the block
+
+    Returns
+    -------
+    zzz, header, columns
+        the marker line, the header column names and the dict of
+        column arrays, empty for a snapshot without ps output. Lines with
+        fewer tokens than the header, such as a line cut short by the next
+        marker, are left out.
+    """
+    eol = block.find(b"\n")
+    zzz = block[:eol if eol >= 0 else len(block)].decode("ascii", "replace")
+    header_eol = block.find(b"\n", eol + 1) if eol >= 0 else -1
+    if header_eol < 0:
+        return zzz.strip(), [], {}
+    header = block[eol + 1:header_eol].decode("ascii", "replace").split()
+    ncols = len(header)
+
+    body = block[header_eol + 1:]
+    if not body.endswith(b"\n"):
+        body += b"\n"
+    buf = np.frombuffer(body, dtype=np.uint8)
+    sep = _SPACE[buf]
+    prev_sep = np.concatenate([[True], sep[:-1]])
+    next_sep = np.concatenate([sep[1:], [True]])
+    starts = np.flatnonzero(~sep & prev_sep)
+    ends = np.flatnonzero(~sep & next_sep) + 1
+    newlines = np.flatnonzero(buf == 10)
+
+    line_of = np.searchsorted(newlines, starts)
+    first = np.searchsorted(line_of, np.arange(len(newlines)))
+    ntok = np.bincount(line_of, minlength=len(newlines))
+    rows = np.flatnonzero(ntok >= ncols)
+    first = first[rows]
+    last = first + ntok[rows] - 1
+
+    columns = {}
+    for k, name in enumerate(header):
+        kind = COLUMN_KINDS.get(name)
+        if kind is None or name not in names:
+            continue
+        tok = first + k
+        s = starts[tok]
+        if kind == 'cmd' and k == ncols - 1:
+            """ The command runs to the end of the line """
+            e = ends[last]
+        else:
+            e = ends[tok]
+        if kind == 'int':
+            values = _to_int(_gather(buf, s, e, INT_WIDTH, right=True))
+        elif kind == 'time':
+            values = _time_to_seconds(buf, s, e)
+        elif kind == 'name':
+            values = _to_strings(_gather(buf, s, e, name_width))
+        else:
+            values = _to_strings(_gather(buf, s, e, cmd_width))
+        columns[name.lower()] = values
+    return zzz.strip(), header, columns
+
+
+def command_name(cmd):
+    """Short name of a ps command line, the key of the per-command counts
+
+    '/usr/sbin/crond -n' -> 'crond', '[kworker/0:1]' -> 'kworker',
+    '-bash' -> 'bash', 'sshd: oracle@pts/0' -> 'sshd'
+    """
+    if isinstance(cmd, bytes):
+        cmd = cmd.decode("ascii", "replace")
+    fields = cmd.split(None, 1)
+    if not fields:
+        return ''
+    name = fields[0]
+    if name.startswith('['):
+        return name.strip('[]').split('/')[0]
+    return name.rsplit('/', 1)[-1].lstrip('-').rstrip(':')
+
+
+def iter_blocks(f, chunk_size=1 << 20):
+    """Yield the zzz blocks of a binary file object as bytes
+
+    The file is read chunk by chunk; text before the first marker is
+    skipped.
+    """
+    marker = b"zzz ***"
+    pending = b""
+    started = False
+    while True:
+        chunk = f.read(chunk_size)
+        pending += chunk
+        pos = 0
+        while True:
+            nxt = pending.find(marker, pos + (len(marker) if started else 0))
+            if nxt < 0:
+                break
+            if started:
+                yield pending[pos:nxt]
+            started = True
+            pos = nxt
+        pending = pending[pos:] if started else pending[-len(marker):]
+        if not chunk:
+            break
+    if started and pending:
+        yield pending
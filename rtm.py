@@ -19,11 +19,45 @@ from argparse import ArgumentParser
 #from DataReader import DataReader
 #from Validation import Validation
 import zlib
+import struct
 import collections
+import calendar
+import numpy as np
+from timeseries import TimeSeries
+from timeparse import key_to_epoch
+from rtm_batch import rtm_batch, fit, slope_sign
 
 
 # global variables
+#wall clock at import; the anomaly history uses the event timestamps instead
 current_millis=int(round(time.time() * 1000,0))
+#how long pushed likelihoods stay in the anomaly history
+HISTORY_MILLIS = 60*60*1000
+#width of the deltaHistory buckets, the half width of the repeat check
+DELTA_BUCKET = 3
+#snapshot blobs: magic, version, then the zlib compressed state
+SNAPSHOT_MAGIC = b"RTMS"
+SNAPSHOT_VERSION = 2
+SNAPSHOT_HEADER = struct.Struct("<4sBI")   # magic, version, detectors
+#window, range_window, interval, min_, max_, boost, leak_detection,
+#interval is int, boost is int, critical_region length
+SNAPSHOT_PARAMS = struct.Struct("<iiddddbBBB")
+#iterations, pushes, ascending, descending, rangeTick, historyNow, anomalies,
+#suppressed, leaks, allzero, has historyNow, sumy, aged, slope, intercept,
+#actualCurrentValue, currentPrediction, rawAnomalyScore, anomalyLikelihood
+SNAPSHOT_STATE = struct.Struct("<qqqqqqqqqBB8d")
+SNAPSHOT_COUNTS = struct.Struct("<III")     # rangeMax, rangeMin, history
+
+
+def log_tracer(rtm, fields):
+    """Tracer writing each traced point to the run logger of the RTM
+
+    Installed by a debug instance; rtm.setTracer(log_tracer, 100) logs
+    one point in 100 of any instance, at the level given to setTracer.
+    """
+    items = sorted(fields.items())
+    rtm.run_logger.log(rtm.traceLevel, "RTM DEBUG::: %s y=%s",
+                       " ".join("%s=%s" % item for item in items), list(rtm.y))
 
 
 
@@ -38,9 +72,8 @@ class RTMInference:
 # implements the RTM algorithm used for KPIs
 class LinearRegressionTemoporalMemory:
     #constructor
-    def __init__(self, window, interval, min_, max_, boost, leak_detection, critical_region, debug):
-        #holds the previous intervals
-        self.x = deque()
+    def __init__(self, window, interval, min_, max_, boost, leak_detection, critical_region, debug,
+                 range_window=0):
         #holds the previous values
         self.y = deque()
         self.xv = []
@@ -55,13 +88,25 @@ class LinearRegressionTemoporalMemory:
         #window represents the number of steps in the past to consider
         self.window = window
         for i in range(0, self.window):
-            self.x.append(0)
             self.y.append(0)
+        #running sums of the window: sum(y), sum(age*y), see rtm_batch.fit
+        self.sumy = 0.0
+        self.aged = 0.0
+        #pushes that moved the x lattice
+        self.pushes = 0
         #interval represents how far apart the steps are
         self.interval = interval
         #range of the signal
         self.min_ = min_
         self.max_ = max_
+        #adaptive normalization: errors are scaled by the range of the last
+        #range_window values instead of max_ - min_; 0 keeps max_ - min_
+        self.adaptive = range_window > 0
+        self.rangeWindow = range_window if self.adaptive else window
+        #(tick, value) of the trailing maxima and minima, like y it starts with zeros
+        self.rangeTick = 0
+        self.rangeMax = deque([(0, 0)])
+        self.rangeMin = deque([(0, 0)])
         #LR bias
         self.intercept = 0
         #LR slope
@@ -74,59 +119,162 @@ class LinearRegressionTemoporalMemory:
         self.critical_region = critical_region
         #debug enabled
         self.debug = debug
-        #store anomaly history
-        self.history = {}
+        #store anomaly history: (event millis, likelihood), oldest first
+        self.history = deque()
+        #decreasing likelihoods of the history, for getMaxFromAnomalyHistory
+        self.historyMax = deque()
+        #history entries with a likelihood above 0
+        self.historyHits = deque()
+        #latest event time pushed
+        self.historyNow = None
         self.previousValue = 0
         #store error history
         self.deltaHistory = deque()
         for i in range(0, self.window*self.HISTORY_LENGTH):
             self.deltaHistory.append(0)
+        #positive deltaHistory items by int(item // DELTA_BUCKET)
+        self.deltaBuckets = {}
         self.rtm_inference = RTMInference()
         self.actualCurrentValue = 0
         self.currentPrediction = 0
         self.rawAnomalyScore = 0
         self.anomalyLikelihood = 0
         self.allzero = True
-        self.run_logger = None
-        self._init_logging()
+        #points pushed, anomalies returned, repeats and leaks signaled
+        self.anomalies = 0
+        self.suppressed = 0
+        self.leaks = 0
+        #tracing hook, see setTracer; None costs one test per point
+        self.tracer = None
+        self.traceEvery = 1
+        self.traceCountdown = 1
+        self.traceLevel = logging.DEBUG
+        #the log file is only created for a debug instance or a log_tracer
+        self.run_logger = logging.getLogger("requests")
+        if self.debug:
+            self._init_logging()
+            self.setTracer(log_tracer)
+
+    def setTracer(self, tracer, sample_every=1, level=logging.DEBUG):
+        """Call tracer(rtm, fields) after every sample_every-th point
+
+        fields is a dict of the values of the point: timestamp, value,
+        prediction, slope, intercept, delta, errorPercent, rawAnomalyScore,
+        anomalyLikelihood and suppressed; the window is rtm.y. Points of an
+        all-zero series only carry timestamp, value and anomalyLikelihood.
+        A tracer of None turns tracing off.
 
-    #computes the relative range of the signal from the history of values y
+        level is the logging level log_tracer writes at. The run logger is
+        opened to that level, and log_tracer on an instance with nowhere
+        to log to opens the log file a debug instance writes.
+        """
+        self.tracer = tracer
+        self.traceEvery = max(1, int(sample_every))
+        self.traceCountdown = 1
+        self.traceLevel = level
+        if tracer is None:
+            return
+        if tracer is log_tracer and not self.run_logger.handlers and \
+                not logging.getLogger().handlers:
+            self._init_logging()
+        if not self.run_logger.isEnabledFor(level):
+            self.run_logger.setLevel(level)
+
+    def getCounters(self):
+        """Counters since construction, as a dict
+
+        points are the values pushed, anomalies the pushes that returned
+        True, suppressed the likelihoods dropped as repeats of an anomaly
+        of the last HISTORY_LENGTH windows, leaks the leak detection
+        triggers.
+        """
+        return {'points': self.iterations, 'anomalies': self.anomalies,
+                'suppressed': self.suppressed, 'leaks': self.leaks}
+
+    def _trace(self, fields):
+        self.traceCountdown -= 1
+        if self.traceCountdown <= 0:
+            self.traceCountdown = self.traceEvery
+            self.tracer(self, fields)
+
+    #computes the relative range of the signal from the last rangeWindow values
     def getRangeFromHistory(self):
-        range_ = max(self.y)-min(self.y)
+        range_ = self.rangeMax[0][1]-self.rangeMin[0][1]
         if range_>0:
             return range_
         return 100
 
+    #slide the trailing max and min over one more value
+    def pushRange(self, value):
+        self.rangeTick = self.rangeTick + 1
+        while self.rangeMax and self.rangeMax[-1][1] <= value:
+            self.rangeMax.pop()
+        self.rangeMax.append((self.rangeTick, value))
+        while self.rangeMin and self.rangeMin[-1][1] >= value:
+            self.rangeMin.pop()
+        self.rangeMin.append((self.rangeTick, value))
+        oldest = self.rangeTick - self.rangeWindow
+        while self.rangeMax[0][0] <= oldest:
+            self.rangeMax.popleft()
+        while self.rangeMin[0][0] <= oldest:
+            self.rangeMin.popleft()
+
     def getMeanFromHistory(self):
-        return sum(self.y)/len(self.y)
+        return self.sumy/len(self.y)
+
+    #x of every y of the window, oldest first
+    def getLattice(self):
+        return [-self.interval*min(self.pushes, self.window-1-i) for i in range(0, self.window)]
+
+    def _bucket(self, height):
+        return int(height // DELTA_BUCKET)
 
     def pushDeltaHistory(self, height):
-        self.deltaHistory.popleft()
+        old = self.deltaHistory.popleft()
+        if old>0 and not math.isinf(old):
+            bucket = self.deltaBuckets[self._bucket(old)]
+            bucket.remove(old)
+            if not bucket:
+                del self.deltaBuckets[self._bucket(old)]
         self.deltaHistory.append(height)
+        if height>0 and not math.isinf(height):
+            self.deltaBuckets.setdefault(self._bucket(height), []).append(height)
 
     def checkAnomalyHistory(self, height):
         found = 0
         delta_min = height - 3
         delta_max = height + 3
-        for item in list(self.deltaHistory):
-            if item>0 and item>delta_min and item<delta_max:
-                found = 1
-                break
+        #a match is within 3 of height, so in one of the 3 nearest buckets
+        if math.isinf(height) or math.isnan(height):
+            return found
+        center = self._bucket(height)
+        for key in (center-1, center, center+1):
+            for item in self.deltaBuckets.get(key, ()):
+                if item>0 and item>delta_min and item<delta_max:
+                    found = 1
+                    return found
         return found
 
+    #age every y by one push, drop the oldest one and add value
+    def pushWindow(self, value):
+        oldest = self.y.popleft()
+        self.y.append(value)
+        self.pushRange(value)
+        self.aged += self.sumy - self.window*oldest
+        self.sumy += value - oldest
+        self.pushes = self.pushes + 1
+        #sum again from scratch now and then, so rounding can not build up
+        if self.pushes % self.window == 0:
+            self.sumy = 0.0
+            self.aged = 0.0
+            for i in range(0, self.window):
+                self.sumy = self.sumy + self.y[i]
+            for i in range(0, self.window):
+                self.aged = self.aged + (self.window-1-i)*self.y[i]
+
     def retrainRegressionModel(self):
-        n = len(self.x)
-        sumx = sum(self.x)
-        sumy = sum(self.y)
-        x_avg = sumx / n
-        y_avg = sumy / n
-        xx_sum = 0.0
-        xy_sum = 0.0
-        for i in range(0, n):
-            xx_sum += (self.x[i] - x_avg) * (self.x[i] - x_avg)
-            xy_sum += (self.x[i] - x_avg) * (self.y[i] - y_avg)
-        self.slope  = xy_sum / xx_sum
-        self.intercept = y_avg - self.slope * x_avg
+        self.slope, self.intercept, y_avg = fit(self.window, self.interval, self.pushes,
+                                                self.sumy, self.aged)
 
     def predict(self, xval):
         return max(self.slope*xval + self.intercept, 0)
@@ -142,41 +290,72 @@ class LinearRegressionTemoporalMemory:
         return anomalyLikelihood
 
     def updateLeakDetection(self):
-        if self.slope > 0:
+        #slopes of rounding noise count as flat, see rtm_batch.slope_sign
+        sign = slope_sign(self.slope, self.sumy/self.window, self.window,
+                          self.interval, self.max_-self.min_)
+        if sign > 0:
             self.ascending = self.ascending + 1
             self.dsescending = 0
-        if self.slope < 0:
+        if sign < 0:
             self.ascending = 0
             self.descending = self.descending + 1
-        if self.slope == 0:
+        if sign == 0:
             self.ascending = 0
             self.descending = 0
 
+    #event time of a pushed timestamp in millis: epoch seconds, a
+    #'YYYY-MM-DD HH:MM:SS' key or a naive UTC datetime
+    def getEventMillis(self, timestm):
+        if isinstance(timestm, datetime.datetime):
+            seconds = calendar.timegm(timestm.utctimetuple()) + timestm.microsecond/1e6
+        elif isinstance(timestm, (str, bytes, type(u''))):
+            try:
+                seconds = float(timestm)
+            except ValueError:
+                seconds = key_to_epoch(timestm)
+        else:
+            seconds = timestm
+        return int(round(seconds*1000))
+
+    #add a likelihood at an event time and evict the entries that aged out
+    def pushAnomalyHistory(self, millis, likelihood):
+        if self.historyNow is None or millis > self.historyNow:
+            self.historyNow = millis
+        self.history.append((millis, likelihood))
+        while self.historyMax and self.historyMax[-1][1] <= likelihood:
+            self.historyMax.pop()
+        self.historyMax.append((millis, likelihood))
+        if likelihood > 0:
+            self.historyHits.append((millis, likelihood))
+        horizon = self.historyNow - HISTORY_MILLIS
+        for entries in (self.history, self.historyMax, self.historyHits):
+            while entries and entries[0][0] < horizon:
+                entries.popleft()
+
     def getMaxFromAnomalyHistory(self, window_millis):
         max_from_history = 0
-        #current_millis = int(round(time.time() * 1000,0))
-        for millis in self.history.keys():
-            if millis > (current_millis - window_millis):
-                if self.history[millis] > max_from_history:
-                    max_from_history = self.history[millis]
+        if self.historyNow is None:
+            return max_from_history
+        #the first entry inside the window is the largest in it
+        for millis, likelihood in self.historyMax:
+            if millis > (self.historyNow - window_millis):
+                max_from_history = max(likelihood, max_from_history)
+                break
         return max_from_history
 
     def getEarliestAnomalyMillis(self, window_millis, threshold):
-        millis=[]
-        anomaly_logger.debug('window_millis: '+str(window_millis))
-        anomaly_logger.debug('threshold: '+str(threshold))
-        anomaly_logger.debug('self.history '+str(self.history))
-        for ms, likelihood in self.history.items():
+        self.run_logger.debug('window_millis: '+str(window_millis))
+        self.run_logger.debug('threshold: '+str(threshold))
+        entries = self.historyHits if threshold > 0 else self.history
+        for ms, likelihood in entries:
             if likelihood >= threshold:
-                millis.append(ms)
-        if millis:
-            anomaly_logger.debug('return min(millis): '+str(min(millis)))
-            return min(millis)
-        else:
-            return None
+                self.run_logger.debug('return min(millis): '+str(ms))
+                return ms
+        return None
 
     def push_refactor(self, timestm, value):
         anomalyLikelihood = 0
+        millis = self.getEventMillis(timestm)
 
         #increment iterations
         if value != 0:
@@ -189,27 +368,12 @@ class LinearRegressionTemoporalMemory:
         self.iterations = self.iterations + 1
         if not self.allzero:
             actualCurrentValue = float(value)
-            self.run_logger.debug("RTM DEBUG::: actualCurrentValue=%s",actualCurrentValue)
             #get the predicted value from the model
             currentPrediction = self.predict(0)
-            self.run_logger.debug("RTM DEBUG::: currentPrediction=%s", currentPrediction)
-            self.run_logger.debug("RTM DEBUG::: history before shifting");
-            for i in range(0, self.window):
-                self.run_logger.debug("RTM DEBUG::: x[%s]=%s  y[%s]=%s", i, self.x[i], i, self.y[i] )
             #shift to the left (lose oldest value)
-            for i in range(0, self.window-1):
-                self.x[i] = self.x[i+1] - self.interval
-            self.x[-1] = 0
-            self.y.popleft()
-            self.y.append(actualCurrentValue)
-            #assign new actual value to the current position
-            self.run_logger.debug("RTM DEBUG::: history after shifting");
-            for i in range(0, self.window):
-                self.run_logger.debug("RTM DEBUG::: x[%s]=%s  y[%s]=%s", i, self.x[i], i, self.y[i] )
+            self.pushWindow(actualCurrentValue)
             #retrain the RTM model
             self.retrainRegressionModel()
-            self.run_logger.debug("RTM DEBUG::: After retrain slope=%s", self.slope)
-            self.run_logger.debug("RTM DEBUG::: After retrain intercept=%s", self.intercept)
             #compare the currentPrediction with the actualCurrentValue
             if self.critical_region == "two_tails":
                 delta = abs(currentPrediction - actualCurrentValue)
@@ -217,11 +381,12 @@ class LinearRegressionTemoporalMemory:
                 delta = currentPrediction - actualCurrentValue
             else: #treat as right_tail by default
                 delta = actualCurrentValue - currentPrediction
-            self.run_logger.debug("RTM DEBUG::: delta_adjusted=%s",delta)
             #find how far is based on the range (this should be between 0 and 1)
             #boost //1 low , 2 medium , 3 high sensitivity
-            errorPercent = delta*(self.boost+5)/(self.max_-self.min_);
-            self.run_logger.debug("RTM DEBUG::: After retrain errorPercent=%s",errorPercent)
+            if self.adaptive:
+                errorPercent = delta*(self.boost+5)/self.getRangeFromHistory();
+            else:
+                errorPercent = delta*(self.boost+5)/(self.max_-self.min_);
             if errorPercent < 0: errorPercent=0
             #compute the raw anomaly score
             rawAnomalyScore = 0
@@ -233,42 +398,37 @@ class LinearRegressionTemoporalMemory:
                     err_logger.error("math range error. errorPercent: "+str(errorPercent))
                     err_logger.error("math range error. errorPercent: "+str(errorPercent))
                     sys.exit(1)
-            self.run_logger.debug("RTM DEBUG::: After retrain rawAnomalyScore=%s",rawAnomalyScore)
             if self.iterations < self.window:
                 anomalyLikelihood = 0
             else:
                 anomalyLikelihood = self.getNormalizedAnomalyScore(rawAnomalyScore)
             mean = self.getMeanFromHistory()
+            found = 0
             if anomalyLikelihood>0:
                 found = self.checkAnomalyHistory(mean + delta)
                 self.pushDeltaHistory(mean+delta)
                 if found>0:
                     #we found it in the history, so we're not signaling it again
                     anomalyLikelihood = 0
+                    self.suppressed += 1
             else:
                 #no anomaly, so setting 0 in history
                 self.pushDeltaHistory(0)
             # check the leak detection
             if self.ascending>3*self.window and self.leak_detection==1:
                 anomalyLikelihood = 1
-                self.run_logger.debug("RTM DEBUG::: Ascending LEAK detected. Setting anomaly to 1")
+                self.leaks += 1
                 self.ascending=0
             # on descending side set it to 0.66 only
             if self.descending>3*self.window and self.leak_detection==1:
                 anomalyLikelihood = 0.66
-                self.run_logger.debug("RTM DEBUG::: Descending PATTERN detected. Setting anomaly to 0.66")
+                self.leaks += 1
                 self.descending = 0
             #update the leak detection with new values based on new slope
             self.updateLeakDetection()
-            #add current reading to history
-            #current_millis = time.time() * 1000
-            self.history[current_millis] = anomalyLikelihood
-            #remove older than 1 day
-            for millis in self.history.keys():
-                if millis < (current_millis - 60*60*1000):
-                    del self.history[millis]
+            #add current reading to history, dropping the entries older than HISTORY_MILLIS
+            self.pushAnomalyHistory(millis, anomalyLikelihood)
             #print("ps_count:" + str(value) + ' ' + "anomalyLikelihood:" + str(anomalyLikelihood))
-            self.run_logger.debug("RTM DEBUG::: After retrain anomalyLikelihood=%s",anomalyLikelihood);
             self.actualCurrentValue = actualCurrentValue
             self.currentPrediction = currentPrediction
             if self.iterations < self.window:
@@ -277,13 +437,22 @@ class LinearRegressionTemoporalMemory:
             else:
                 self.rawAnomalyScore = rawAnomalyScore
                 self.anomalyLikelihood = anomalyLikelihood
+            if self.tracer is not None:
+                self._trace({'timestamp': timestm, 'value': actualCurrentValue,
+                             'prediction': currentPrediction,
+                             'slope': self.slope, 'intercept': self.intercept,
+                             'delta': delta, 'errorPercent': errorPercent,
+                             'rawAnomalyScore': rawAnomalyScore,
+                             'anomalyLikelihood': anomalyLikelihood,
+                             'suppressed': found > 0})
         else: # all-zero rtm, most lists/queues are unchanged with all zeros
-            self.history[current_millis] = self.anomalyLikelihood
-            for millis in self.history.keys():
-                if millis < (current_millis - 60*60*1000):
-                    del self.history[millis]
+            self.pushAnomalyHistory(millis, self.anomalyLikelihood)
+            if self.tracer is not None:
+                self._trace({'timestamp': timestm, 'value': value,
+                             'anomalyLikelihood': self.anomalyLikelihood})
 
         if anomalyLikelihood == 1:
+            self.anomalies += 1
             return True
         else:
             return False
@@ -295,10 +464,22 @@ class LinearRegressionTemoporalMemory:
         # logging.basicConfig(stream=sys.stderr, level=logging.INFO)
         logging.basicConfig(filename = os.path.join(os.getcwd(), file_name), level = logging.DEBUG, filemode = 'a', format = '%(asctime)s - %(levelname)s:\
     %(message)s')
-        self.run_logger = logging.getLogger("requests")
-        self.run_logger.setLevel(logging.WARNING)
+        self.run_logger.setLevel(logging.DEBUG)
 
     def analyze(self, ps_dict_unsorted):
+        """Push every point of the series, return the anomalous ones
+
+        A TimeSeries is walked in its own order and the anomalies come back
+        as a TimeSeries in that order; a {timestamp: value} dict is sorted
+        first and the anomalies come back as a dict.
+        """
+        if isinstance(ps_dict_unsorted, TimeSeries):
+            hits = [self.push_refactor(timestamp, ps_count)
+                    for timestamp, ps_count in ps_dict_unsorted]
+            hits = np.array(hits, dtype=bool)
+            return TimeSeries(ps_dict_unsorted.timestamps[hits],
+                              ps_dict_unsorted.values[hits], sort=False)
+
         ps_od = collections.OrderedDict(sorted(ps_dict_unsorted.items()))
         keys, values = zip(*ps_od.items())
         abnomal_data_dict_unsorted = {}
@@ -314,6 +495,152 @@ class LinearRegressionTemoporalMemory:
                 abnomal_data_dict_unsorted[timestamp] = ps_count
         return abnomal_data_dict_unsorted
 
+    def analyze_batch(self, series):
+        """Vectorized analyze() of a TimeSeries, see rtm_batch
+
+        Returns the same anomalies as analyze() on a freshly constructed
+        model; the model itself is not advanced.
+        """
+        result = rtm_batch(series.values, self.window, self.interval,
+                           self.min_, self.max_, self.boost,
+                           self.leak_detection, self.critical_region,
+                           self.rangeWindow if self.adaptive else 0)
+        hits = result.likelihood == 1
+        return TimeSeries(series.timestamps[hits], series.values[hits], sort=False)
+
+    #the full state as a versioned, compressed blob, see restore()
+    def snapshot(self):
+        return SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 1) + \
+            zlib.compress(self._pack_state())
+
+    #a model that resumes where the snapshot was taken
+    @classmethod
+    def restore(cls, blob):
+        payload = _unpack_snapshot(blob, 1)
+        rtm, offset = cls._unpack_state(payload, 0)
+        return rtm
+
+    def _pack_state(self):
+        region = self.critical_region.encode("ascii")
+        parts = [SNAPSHOT_PARAMS.pack(self.window, self.rangeWindow if self.adaptive else 0,
+                                      self.interval, self.min_, self.max_, self.boost,
+                                      self.leak_detection, isinstance(self.interval, int),
+                                      isinstance(self.boost, int), len(region)),
+                 region,
+                 SNAPSHOT_STATE.pack(self.iterations, self.pushes, self.ascending,
+                                     self.descending, self.rangeTick, self.historyNow or 0,
+                                     self.anomalies, self.suppressed, self.leaks,
+                                     self.allzero, self.historyNow is not None,
+                                     self.sumy, self.aged, self.slope, self.intercept,
+                                     self.actualCurrentValue, self.currentPrediction,
+                                     self.rawAnomalyScore, self.anomalyLikelihood),
+                 struct.pack("<%dd" % self.window, *self.y),
+                 struct.pack("<%dd" % len(self.deltaHistory), *self.deltaHistory),
+                 SNAPSHOT_COUNTS.pack(len(self.rangeMax), len(self.rangeMin), len(self.history))]
+        for entries in (self.rangeMax, self.rangeMin, self.history):
+            for entry in entries:
+                parts.append(struct.pack("<qd", *entry))
+        return b"".join(parts)
+
+    @classmethod
+    def _unpack_state(cls, data, offset):
+        (window, range_window, interval, min_, max_, boost, leak_detection,
+         interval_int, boost_int, region_len) = SNAPSHOT_PARAMS.unpack_from(data, offset)
+        offset += SNAPSHOT_PARAMS.size
+        region = data[offset:offset+region_len].decode("ascii")
+        offset += region_len
+        if interval_int:
+            interval = int(interval)
+        if boost_int:
+            boost = int(boost)
+        rtm = cls(window, interval, min_, max_, boost, leak_detection, region, 0,
+                  range_window=range_window)
+
+        state = SNAPSHOT_STATE.unpack_from(data, offset)
+        offset += SNAPSHOT_STATE.size
+        (rtm.iterations, rtm.pushes, rtm.ascending, rtm.descending, rtm.rangeTick,
+         history_now, rtm.anomalies, rtm.suppressed, rtm.leaks, allzero,
+         has_now) = state[:11]
+        (rtm.sumy, rtm.aged, rtm.slope, rtm.intercept, rtm.actualCurrentValue,
+         rtm.currentPrediction, rtm.rawAnomalyScore, rtm.anomalyLikelihood) = state[11:]
+        rtm.allzero = bool(allzero)
+        rtm.historyNow = history_now if has_now else None
+
+        rtm.y = deque(struct.unpack_from("<%dd" % window, data, offset))
+        offset += 8*window
+        size = window*rtm.HISTORY_LENGTH
+        deltas = struct.unpack_from("<%dd" % size, data, offset)
+        offset += 8*size
+        #deltaHistory goes through pushDeltaHistory to rebuild its buckets
+        for height in deltas:
+            rtm.pushDeltaHistory(height)
+
+        counts = SNAPSHOT_COUNTS.unpack_from(data, offset)
+        offset += SNAPSHOT_COUNTS.size
+        for entries, count in zip((rtm.rangeMax, rtm.rangeMin, rtm.history), counts):
+            entries.clear()
+            for i in range(0, count):
+                entries.append(struct.unpack_from("<qd", data, offset))
+                offset += 16
+        #the max and hits deques are views of the history
+        for millis, likelihood in rtm.history:
+            while rtm.historyMax and rtm.historyMax[-1][1] <= likelihood:
+                rtm.historyMax.pop()
+            rtm.historyMax.append((millis, likelihood))
+            if likelihood > 0:
+                rtm.historyHits.append((millis, likelihood))
+        return rtm, offset
+
+def _unpack_snapshot(blob, count=None):
+    magic, version, detectors = SNAPSHOT_HEADER.unpack_from(blob, 0)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError("Not a version %d RTM snapshot" % SNAPSHOT_VERSION)
+    if count is not None and detectors != count:
+        raise ValueError("Snapshot holds %d detectors, not %d" % (detectors, count))
+    return zlib.decompress(blob[SNAPSHOT_HEADER.size:])
+
+def save_detectors(path, detectors):
+    """Write many named detectors to one snapshot file
+
+    Parameters
+    ----------
+    path : string
+        file to write; it is replaced atomically
+
+    detectors : dict of string -> LinearRegressionTemoporalMemory
+    """
+    parts = []
+    for name, rtm in detectors.items():
+        name = name.encode("utf-8")
+        state = rtm._pack_state()
+        parts.append(struct.pack("<HI", len(name), len(state)))
+        parts.append(name)
+        parts.append(state)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(detectors)))
+        f.write(zlib.compress(b"".join(parts)))
+    os.rename(tmp, path)
+
+def load_detectors(path):
+    """Read the detectors written by save_detectors, as a dict by name"""
+    with open(path, "rb") as f:
+        blob = f.read()
+    count = SNAPSHOT_HEADER.unpack_from(blob, 0)[2]
+    data = _unpack_snapshot(blob, count)
+    detectors = collections.OrderedDict()
+    offset = 0
+    for i in range(0, count):
+        name_len, state_len = struct.unpack_from("<HI", data, offset)
+        offset += 6
+        name = data[offset:offset+name_len].decode("utf-8")
+        offset += name_len
+        detectors[name], end = LinearRegressionTemoporalMemory._unpack_state(data, offset)
+        if end != offset + state_len:
+            raise ValueError("Corrupt RTM snapshot entry " + name)
+        offset = end
+    return detectors
+
 def main():
     rtm = LinearRegressionTemoporalMemory(10, 10, 0, 600, 2, 0, "right_tail", 0)
     rtm.analyze({'1':'200', '2':'201', '3':'205', '4':'1010', '5':'200'})
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+"""
+    NAME
+      rtm_batch.py
+
+    DESCRIPTION
+      Batch engine of the RTM algorithm: the output of
+      LinearRegressionTemoporalMemory.push_refactor for a whole array of
+      values at once.
+
+    NOTES
+      Both engines fit the regression from running sums rather than by
+      walking the window: after push t the x lattice only depends on t,
+      so sum(x), the x mean and the x spread come from lattice_stats, and
+
+        sum((x - x_avg) * (y - y_avg)) = -interval * A - y_avg * sum(x)
+                                        = (-interval * A * n - S * sum(x)) / n
+
+      where A = sum(age * y) over the window, age counting the pushes
+      since each y came in. Here S = sum(y) and A are computed for all
+      points at once:
+
+      - for integer valued series (ps counts) from cumulative sums, in
+        O(n) whatever the window; the sums are exact, so the output
+        matches the streaming class bit for bit;
+      - otherwise one window position at a time, in the order the
+        streaming class recomputes them, O(n * window), matching it up
+        to the rounding of its running sums between recomputes.
+
+      Neither matches the original per-point fit bit for bit: it summed
+      the centered products, and left slopes of rounding noise where a
+      window is flat. The leak counters therefore take the slope sign
+      through slope_sign(), which treats such slopes as 0 in every
+      engine; check_rtm.py compares the engines with the per-point fit.
+
+      The repeat suppression (deltaHistory) only looks at points whose
+      likelihood is above 0 before suppression, so only those are looped
+      over; the leak counters are run lengths of the slope sign, whose
+      resets fall on multiples of 3*window + 1. The trailing range of the
+      adaptive normalization is a sliding max and min computed from
+      per-block prefix and suffix maxima (van Herk / Gil-Werman), O(n)
+      whatever its window.
+
+"""
+
+"""Global Variables"""
+
+""" Length of the repeat suppression history, in windows """
+HISTORY_LENGTH = 3
+
+"""
+Per-point output of rtm_batch, one array entry per input value
+
+prediction : value predicted for the point before it was seen
+raw_score  : sigmoid anomaly score, 0 for the first window of points
+likelihood : normalized anomaly likelihood, 0, 0.66 or 1
+slope      : regression slope after the point
+intercept  : regression intercept after the point
+"""
+RTMBatchResult = collections.namedtuple(
+    'RTMBatchResult',
+    ['prediction', 'raw_score', 'likelihood', 'slope', 'intercept'])
+
+
+""" Largest magnitude up to which float64 sums of integers are exact """
+EXACT_LIMIT = 2 ** 53
+""" Slopes within this fraction of the data scale per x step count as flat """
+SLOPE_TOLERANCE = 1e-12
+
+
+def lattice_stats(window, interval, pushes):
+    """sum(x), x mean and sum((x - x_avg) ** 2) of the x lattice
+
+    After k pushes the window holds one y of each age 0 .. k-1 at
+    x = -age * interval, and the window - k initial zeros at x = -k *
+    interval; from window - 1 pushes on the lattice no longer changes.
+    x_avg is sumx / window, an integer division under python 2 for an
+    integer interval, as in the original per-point fit. Any argument can
+    be a numpy array, for one lattice per series (see rtm_bank).
+    """
+    if isinstance(pushes, np.ndarray) or isinstance(window, np.ndarray):
+        k = np.minimum(pushes, window - 1)
+    else:
+        k = min(pushes, window - 1)
+    rest = window - k
+    sumx = -interval * (rest * k + k * (k - 1) // 2)
+    sumxx = interval * interval * (rest * k * k + (k - 1) * k * (2 * k - 1) // 6)
+    x_avg = sumx / window
+    xx_sum = sumxx - 2 * x_avg * sumx + window * x_avg * x_avg
+    return sumx, x_avg, xx_sum * 1.0
+
+
+def fit(window, interval, pushes, sumy, aged):
+    """slope, intercept and y mean from the running sums of the window
+
+    sumy is sum(y) and aged is sum(age * y) over the window after the
+    given number of pushes; works on floats and numpy arrays alike.
+    """
+    return solve(window, interval, lattice_stats(window, interval, pushes),
+                 sumy, aged)
+
+
+def solve(window, interval, lattice, sumy, aged):
+    """fit() with the lattice_stats of the window given"""
+    sumx, x_avg, xx_sum = lattice
+    y_avg = sumy / window
+    """ Scaled by window, the numerator is exact for integer data, so a
+    flat window of integers gets a slope of exactly 0 """
+    slope = (-interval * aged * window - sumy * sumx) / (window * xx_sum)
+    return slope, y_avg - slope * x_avg, y_avg
+
+
+def slope_sign(slope, y_avg, window, interval, span):
+    """1, -1 or 0 for a rising, falling or flat slope
+
+    A flat window can leave a slope of rounding noise, about 1e-16 of
+    |y| / (interval * window), and how much depends on how the fit was
+    summed. Slopes within SLOPE_TOLERANCE of (|y_avg| + span) / (interval
+    * window) are taken as flat, so the leak counters see the same sign
+    whichever engine fitted the window; the smallest real slope of
+    integer data at window 1000 is still far above it. span is max_ -
+    min_; works on floats and numpy arrays alike.
+    """
+    tolerance = SLOPE_TOLERANCE * (abs(y_avg) + abs(span)) / (abs(interval) * window)
+    return (slope > tolerance) * 1 - (slope < -tolerance) * 1
+
+
+def _leak_triggers(counting, reset, period):
+    """Points where a leak counter exceeds period - 1
+
+    The counter counts the points where counting is set since the last
+    point where reset is set; it is checked against period - 1 before the
+    point's own update, and goes back to 0 when it triggers.
+    """
+    total = np.cumsum(counting)
+    base = np.maximum.accumulate(np.where(reset, total, 0))
+    run = total - base
+    fire = counting & (run > 0) & (run % period == 0)
+    triggers = np.zeros(len(counting), dtype=bool)
+    triggers[1:] = fire[:-1]
+    return triggers
+
+
+def _sliding_max(a, width):
+    """Max of every a[i:i + width], from per-block prefix and suffix maxima"""
+    n = len(a) - width + 1
+    blocks = -(-len(a) // width)
+    padded = np.full(blocks * width, -np.inf)
+    padded[:len(a)] = a
+    padded = padded.reshape(blocks, width)
+    prefix = np.maximum.accumulate(padded, axis=1).ravel()
+    suffix = np.maximum.accumulate(padded[:, ::-1], axis=1)[:, ::-1].ravel()
+    return np.maximum(suffix[:n], prefix[width - 1:width - 1 + n])
+
+
+def trailing_range(values, width):
+    """max - min of each value and the width - 1 before it
+
+    Values before the first one count as 0, like the initial window of
+    the streaming class; a range of 0 gives 100, as getRangeFromHistory.
+    """
+    padded = np.concatenate([np.zeros(width - 1), values])
+    span = _sliding_max(padded, width) + _sliding_max(-padded, width)
+    return np.where(span > 0, span, 100.0)
+
+
+def rtm_batch(values, window, interval, min_, max_, boost, leak_detection,
+              critical_region, range_window=0):
+    """Run the RTM algorithm over an array of values
+
+    Parameters
+    ----------
+    values : sequence of number
+        the series, in time order
+
+    window, interval, min_, max_, boost, leak_detection, critical_region,
+    range_window
+        as for LinearRegressionTemoporalMemory
+
+    Returns
+    -------
+    result : RTMBatchResult
+        the arrays a fresh LinearRegressionTemoporalMemory would produce
+        pushing the values one by one: prediction is currentPrediction,
+        raw_score and likelihood are rawAnomalyScore and
+        anomalyLikelihood, slope and intercept the model after each push.
+        push_refactor reports an anomaly where likelihood == 1.
+
+    Examples
+    --------
+    >>> r = rtm_batch(series.values, 10, 10, series.min(), series.max(),
+    ...               2, 0, 'right_tail')
+    >>> anomalies = series.timestamps[r.likelihood == 1]
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    prediction = np.zeros(n)
+    raw_score = np.zeros(n)
+    likelihood = np.zeros(n)
+    slope = np.zeros(n)
+    intercept = np.zeros(n)
+    result = RTMBatchResult(prediction, raw_score, likelihood, slope, intercept)
+
+    """ Leading zeros leave the model untouched, only iterations count them """
+    nonzero = np.flatnonzero(values != 0)
+    if not len(nonzero):
+        return result
+    skip = nonzero[0]
+    v = values[skip:]
+    m = len(v)
+    iterations = np.arange(skip + 1, n + 1)
+
+    """ The window after push t is padded[t + 1:t + window + 1] """
+    padded = np.concatenate([np.zeros(window), v])
+    if np.all(v == np.round(v)) and \
+            np.abs(v).sum() * (m + window) < EXACT_LIMIT:
+        g = np.arange(m + window, dtype=np.float64)
+        total = np.concatenate([[0.0], np.cumsum(padded)])
+        weighted = np.concatenate([[0.0], np.cumsum(g * padded)])
+        t = np.arange(m)
+        sumy = total[t + window + 1] - total[t + 1]
+        aged = (t + window) * sumy - (weighted[t + window + 1] - weighted[t + 1])
+    else:
+        step = padded.strides[0]
+        y = as_strided(padded[1:], shape=(m, window), strides=(step, step))
+        sumy = np.zeros(m)
+        aged = np.zeros(m)
+        for i in range(window):
+            sumy = sumy + y[:, i]
+        for i in range(window):
+            aged = aged + (window - 1 - i) * y[:, i]
+
+    """ The x lattice stops changing after window - 1 pushes """
+    b = np.empty(m)
+    a = np.empty(m)
+    y_avg = np.empty(m)
+    for k in range(1, window):
+        rows = slice(k - 1, k) if k < window - 1 else slice(k - 1, None)
+        b[rows], a[rows], y_avg[rows] = fit(window, interval, k,
+                                            sumy[rows], aged[rows])
+
+    """ The prediction of push t comes from the model of push t - 1 """
+    pred = np.zeros(m)
+    pred[1:] = np.maximum(a[:-1], 0.0)
+
+    if critical_region == "two_tails":
+        delta = np.abs(pred - v)
+    elif critical_region == "left_tail":
+        delta = pred - v
+    else:
+        delta = v - pred
+    with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+        if range_window > 0:
+            error = delta * (boost + 5) / trailing_range(v, range_window)
+        else:
+            error = delta * (boost + 5) / (max_ - min_)
+        error = np.where(error < 0, 0, error)
+        raw = np.where(error > 0, 1 / (1 + np.exp(-(40 * error - 10))), 0.0)
+    warm = iterations >= window
+    level = np.where(raw > 0.9, 1.0, np.where(raw > 0.70, 0.66, 0.0))
+    level = np.where(warm, level, 0.0)
+
+    """ Repeat suppression over the last HISTORY_LENGTH windows of points """
+    height = y_avg + delta
+    span = window * HISTORY_LENGTH
+    candidates = np.flatnonzero(level > 0).tolist()
+    heights = height[candidates].tolist()
+    for j, t in enumerate(candidates):
+        h = heights[j]
+        low = h - 3
+        high = h + 3
+        k = j - 1
+        while k >= 0 and candidates[k] >= t - span:
+            item = heights[k]
+            if item > 0 and item > low and item < high:
+                level[t] = 0
+                break
+            k -= 1
+
+    if leak_detection == 1:
+        period = 3 * window + 1
+        sign = slope_sign(b, y_avg, window, interval, max_ - min_)
+        level[_leak_triggers(sign > 0, sign <= 0, period)] = 1
+        level[_leak_triggers(sign < 0, sign == 0, period)] = 0.66
+
+    prediction[skip:] = pred
+    raw_score[skip:] = np.where(warm, raw, 0.0)
+    likelihood[skip:] = level
+    slope[skip:] = b
+    intercept[skip:] = a
+    return result
@@ -25,33 +25,34 @@ A simple client to run CLA anomaly detection using the OPF.
 """
 
 from optparse import OptionParser
+import os
 import sys
-import csv
 import math
 import datetime
-import dateutil.parser
 import json
 import collections
-import plotly.plotly as py
-import plotly.graph_objs as go
+import numpy as np
 from oswdata_ps import OSWData, PS
-from rtm import LinearRegressionTemoporalMemory
-
-from nupic.frameworks.opf.modelfactory import ModelFactory
-from nupic.frameworks.opf.predictionmetricsmanager import MetricsManager
-
-from nupic.algorithms.anomaly_likelihood import AnomalyLikelihood
+from oswdata_cache import OSWCache
+from timeparse import epoch_to_key
+from timeseries import TimeSeries
+from csvseries import read_csv_series
+from scorefile import ScoreWriter, load_scores
+from plotrender import plot_series, MAX_POINTS
+import detectors
 
 """
 Global variables
 """
-""" Dictionary: timestamp: data """
-g_ps_count_dict_unsorted = {}
-g_abnomal_data_dict_unsorted={}
+""" TimeSeries: timestamp, data """
+g_ps_count_series = TimeSeries()
+g_abnomal_data_series = TimeSeries()
+""" group name: (count TimeSeries, anomaly TimeSeries), with --groupBy """
+g_group_series = collections.OrderedDict()
 
 def runAnomaly(options):
-    global g_ps_count_dict_unsorted
-    global g_abnomal_data_dict_unsorted
+    global g_ps_count_series
+    global g_abnomal_data_series
     
     """
     Create and run a CLA Model on the given dataset (based on the hotgym anomaly
@@ -61,154 +62,168 @@ def runAnomaly(options):
     with open("model_params.json") as fp:
         modelParams = json.load(fp)
     
-    if options.oswpsDir != "":
-        # Get PS dictionary
-        osw = OSWData(options.oswpsDir, PS)
-        osw.traverse_dir()
-        g_ps_count_dict_unsorted = osw.get_ps_dict()
-        options.max = ps_max_value = max(g_ps_count_dict_unsorted.values())
-        options.min = ps_min_value = min(g_ps_count_dict_unsorted.values())
-        print("Min value:" + str(ps_min_value) + ', ' + "Max value:" + str(ps_max_value))
-    
-    # Update the resolution value for the encoder
-    sensorParams = modelParams['modelParams']['sensorParams']
-    numBuckets = modelParams['modelParams']['sensorParams']['encoders']['value'].pop('numBuckets')
-    resolution = options.resolution
-    if resolution is None:
-        resolution = max(0.001,
-                       (options.max - options.min) / numBuckets)
-    print("Using resolution value: {0}".format(resolution))
-    sensorParams['encoders']['value']['resolution'] = resolution
-    
-    model = ModelFactory.create(modelParams)
-    model.enableInference({'predictedField': 'value'})
+    if options.inputFile == "" and options.oswpsDir != "" and options.groupBy != "":
+        runGroupAnomaly(options, modelParams)
+        return
+
     if options.inputFile != "":
-        with open(options.inputFile) as fin:
-            # Open file and setup headers
-            # Here we write the log likelihood value as the 'anomaly score'
-            # The actual CLA outputs are labeled 'raw anomaly score'
-            reader = csv.reader(fin)
-            csvWriter = csv.writer(open(options.outputFile, "wb"))
-            csvWriter.writerow(["timestamp", "value",
-                                "_raw_score", "likelihood_score", "log_likelihood_score"])
-            headers = reader.next()
-    
-            # The anomaly likelihood object
-            anomalyLikelihood = AnomalyLikelihood()
-    
-            # Iterate through each record in the CSV file
-            print "Starting processing at", datetime.datetime.now()
-            for i, record in enumerate(reader, start=1):
-    
-              # Convert input data to a dict so we can pass it into the model
-              inputData = dict(zip(headers, record))
-              inputData["value"] = float(inputData["value"])
-              inputData["dttm"] = dateutil.parser.parse(inputData["dttm"])
-              #inputData["dttm"] = datetime.datetime.now()
-    
-              # Send it to the CLA and get back the raw anomaly score
-              result = model.run(inputData)
-              anomalyScore = result.inferences['anomalyScore']
-    
-              # Compute the Anomaly Likelihood
-              likelihood = anomalyLikelihood.anomalyProbability(
-                  inputData["value"], anomalyScore, inputData["dttm"])
-              logLikelihood = anomalyLikelihood.computeLogLikelihood(likelihood)
-              if likelihood > 0.9999:
-                print "Anomaly detected:", inputData['dttm'], inputData['value'], likelihood
-    
-              # Write results to the output CSV file
-              csvWriter.writerow([inputData["dttm"], inputData["value"],
-                                  anomalyScore, likelihood, logLikelihood])
-    
-              # Progress report
-              if (i % 1000) == 0:
-                print i, "records processed"
+        series = read_csv_series(options.inputFile)
+        min_, max_ = options.min, options.max
     elif options.oswpsDir != "":
-        if options.use_rtm == True:
-            rtm_sensitivity = 2
-            rtm = LinearRegressionTemoporalMemory(window=10, interval=10, min_=options.min,
-                                                  max_=options.max, boost=rtm_sensitivity,
-                                                  leak_detection=0, critical_region="right_tail",
-                                                  debug=0)
-            g_abnomal_data_dict_unsorted = rtm.analyze(g_ps_count_dict_unsorted)
+        # Get PS dictionary
+        zzz_index_dir = None
+        if options.cacheDir != "":
+            zzz_index_dir = os.path.join(options.cacheDir, "zzzidx")
+        osw = OSWData(options.oswpsDir, PS, zzz_index_dir)
+        if options.start != "" or options.end != "":
+            series = osw.query(options.start or None, options.end or None)
+        elif options.checkpoint != "":
+            series = osw.traverse_new(options.checkpoint)
         else:
-            csvWriter = csv.writer(open(options.outputFile, "wb"))
-            csvWriter.writerow(["timestamp", "value",
-                                "_raw_score", "likelihood_score", "log_likelihood_score"])
-            ps_od = collections.OrderedDict(sorted(g_ps_count_dict_unsorted.items()))
-        
-            # The anomaly likelihood object
-            anomalyLikelihood = AnomalyLikelihood()
-        
-            # Iterate through each record in the CSV file
-            print "Starting processing at", datetime.datetime.now()
-            for i, timestamp in enumerate(ps_od):
-                ps_count = ps_od[timestamp]
-                  
-                inputData = {}
-                inputData["value"] = float(ps_count)
-                inputData["dttm"] = dateutil.parser.parse(timestamp)
-                #inputData["dttm"] = datetime.datetime.now()
-                
-                # Send it to the CLA and get back the raw anomaly score
-                result = model.run(inputData)
-                anomalyScore = result.inferences['anomalyScore']
-                
-                # Compute the Anomaly Likelihood
-                likelihood = anomalyLikelihood.anomalyProbability(
-                    inputData["value"], anomalyScore, inputData["dttm"])
-                logLikelihood = anomalyLikelihood.computeLogLikelihood(likelihood)
-                if likelihood > 0.9999:
-                    print "Anomaly detected:", inputData['dttm'], inputData['value'], likelihood
-                    g_abnomal_data_dict_unsorted[timestamp] = ps_count
-                
-                # Write results to the output CSV file
-                csvWriter.writerow([inputData["dttm"], inputData["value"],
-                                    anomalyScore, likelihood, logLikelihood])
-                
-                # Progress report
-                if (i % 1000) == 0:
-                  print i, "records processed"
-
-
-            print "Completed processing", i, "records at", datetime.datetime.now()
+            cache = None
+            if options.cacheDir != "":
+                cache = OSWCache(options.cacheDir)
+            osw.traverse_dir(processes=options.processes or None, cache=cache)
+            series = osw.get_ps_series()
+        g_ps_count_series = series
+        if not len(series):
+            print("No snapshots to analyse in " + options.oswpsDir)
+            return
+        options.max = max_ = series.max()
+        options.min = min_ = series.min()
+    else:
+        return
+
+    """ Incremental runs carry on the model and the output of the previous ones """
+    incremental = options.inputFile == "" and options.checkpoint != ""
+    detector = _create_detector(options, modelParams)
+    state_file = _state_file(options, detector)
+    if state_file != "" and os.path.exists(state_file):
+        detector.load(state_file)
+        print("Resuming the detector saved in " + state_file + " (min value:" +
+              str(detector.min_) + ', ' + "max value:" + str(detector.max_) + ")")
+    else:
+        if incremental and state_file == "":
+            print("The " + options.detector + " detector cannot save its model;"
+                  " it starts over on the new snapshots of every run")
+        if options.inputFile == "":
+            print("Min value:" + str(min_) + ', ' + "Max value:" + str(max_))
+        detector.fit(series, min_, max_)
+    with _open_output(options, append=incremental) as writer:
+        anomalies = _analyze(detector, series, writer)
+    if state_file != "":
+        detector.save(state_file)
+    if incremental:
+        """ Plot everything scored so far, not only the new snapshots """
+        scores = load_scores(options.outputFile)
+        hits = detector.is_anomaly(scores.likelihood)
+        g_ps_count_series = TimeSeries(scores.timestamps, scores.values, sort=False)
+        anomalies = TimeSeries(scores.timestamps[hits], scores.values[hits], sort=False)
+    if options.inputFile == "":
+        g_abnomal_data_series = anomalies
     print "Anomaly scores for", options.inputFile,
     print "have been written to", options.outputFile
 
-def _plot_diagram(normal_unsorted_dict, abnomal_unsorted_dict, filename):
-    normal_ps_od = collections.OrderedDict(sorted(normal_unsorted_dict.items()))
-    normal_keys, normal_values = zip(*normal_ps_od.items())
-    abnomal_ps_od = collections.OrderedDict(sorted(abnomal_unsorted_dict.items()))
-    abnomal_keys, abnomal_values = zip(*abnomal_ps_od.items())
-    
-    normal_color = dict(color='#0000FF')
-    abnomal_color = dict(color='#FF0000')
-
-    trace_normal = go.Scatter(
-        x = normal_keys,
-        y = normal_values,
-        mode = 'lines',
-        marker=normal_color
-    )
-    
-    trace_abnomal = go.Scatter(
-        x = abnomal_keys,
-        y = abnomal_values,
-        mode = 'markers',
-        marker=abnomal_color
-    )
+def _open_output(options, append=False):
+    # Here we write the log likelihood value as the 'anomaly score'
+    # The actual CLA outputs are labeled 'raw anomaly score'
+    return ScoreWriter(options.outputFile, binary=options.outputFormat == "bin",
+                       compress=options.compress, append=append)
 
-    data = [trace_normal, trace_abnomal]
-    #py.iplot(data, filename=filename)
-    py.plot(data, filename=filename)
+def _state_file(options, detector):
+    """Model file of --stateFile, by default next to --checkpoint for the
+    detectors that can save their model"""
+    if options.stateFile != "":
+        return options.stateFile
+    if options.checkpoint != "" and detector.supports_state:
+        return options.checkpoint + ".model"
+    return ""
 
-def plot_diagram(options):
-    if options.use_rtm == True:
-        filename = 'ps_count_crond_problems_with_rtm_algorithm'
+def _create_detector(options, modelParams):
+    """Detector named by --detector, or by -r/-t when it is not given"""
+    if options.detector == "":
+        options.detector = "rtm" if options.use_rtm else "htm"
+    return create_detector(options.detector, modelParams, options.resolution,
+                           options.rangeWindow)
+
+def create_detector(name, modelParams, resolution=None, range_window=0):
+    """Detector registered as name, with the options that apply to it"""
+    if name == "rtm":
+        return detectors.create("rtm", range_window=range_window)
+    if name == "htm":
+        return detectors.create("htm", modelParams=modelParams,
+                                resolution=resolution)
+    return detectors.create(name)
+
+def _analyze(detector, series, writer, verbose=True):
+    """Score a TimeSeries with a fitted detector, return the anomalies
+
+    Detectors that support it get the whole series at once; the others
+    are fed one record at a time. Every point goes to the ScoreWriter;
+    verbose prints the anomalies and the progress as they come.
+    """
+    if verbose:
+        print "Starting processing at", datetime.datetime.now()
+    if detector.supports_batch:
+        result = detector.update_batch(series)
+        hits = result.anomaly
+        writer.write(series.timestamps, series.values, result.raw_score,
+                     result.likelihood, result.log_likelihood)
+        if verbose:
+            """ The lines the record at a time loop prints, once scored """
+            ticks = (np.arange(1, len(series) + 1) % 1000) == 0
+            for i in np.flatnonzero(hits | ticks).tolist():
+                if hits[i]:
+                    print "Anomaly detected:", epoch_to_key(int(series.timestamps[i])), \
+                        float(series.values[i]), float(result.likelihood[i])
+                if ticks[i]:
+                    print i + 1, "records processed"
     else:
-        filename = 'ps_count_crond_problems_with_htm_algorithm'
-    _plot_diagram(g_ps_count_dict_unsorted, g_abnomal_data_dict_unsorted, filename)
+        hits = np.zeros(len(series), dtype=bool)
+        for i, (timestamp, value) in enumerate(series):
+            record = detector.update_one(timestamp, value)
+            if record.anomaly:
+                if verbose:
+                    print "Anomaly detected:", epoch_to_key(timestamp), value, record.likelihood
+                hits[i] = True
+
+            # Write results to the output file
+            writer.write_one(timestamp, value, record.raw_score, record.likelihood,
+                             record.log_likelihood)
+
+            # Progress report
+            if verbose and ((i + 1) % 1000) == 0:
+                print i + 1, "records processed"
+
+    if verbose:
+        print "Completed processing", len(series), "records at", datetime.datetime.now()
+    return TimeSeries(series.timestamps[hits], series.values[hits], sort=False)
+
+def runGroupAnomaly(options, modelParams):
+    """Run detection on the top-N per-command/user/regex count series"""
+    osw = OSWData(options.oswpsDir, PS)
+    osw.traverse_groups(by=options.groupBy, processes=options.processes or None)
+    with _open_output(options) as writer:
+        for name in osw.top_groups(options.top):
+            series = osw.get_group_series(name)
+            min_, max_ = series.min(), series.max()
+            print("Group " + name + ": min value:" + str(min_) + ', ' + "max value:" + str(max_))
+            detector = _create_detector(options, modelParams).fit(series, min_, max_)
+            anomalies = _analyze(detector, series, writer)
+            print("Group " + name + ": " + str(len(anomalies)) + " anomalies")
+            g_group_series[name] = (series, anomalies)
+
+def _plot_diagram(normal_series, abnomal_series, filename, max_points=MAX_POINTS):
+    plot_series(normal_series, abnomal_series, filename + '.html', max_points)
+    print("Plot written to " + filename + '.html')
+
+def plot_diagram(options):
+    filename = 'ps_count_crond_problems_with_' + options.detector + '_algorithm'
+    if g_group_series:
+        for name, (series, anomalies) in g_group_series.items():
+            _plot_diagram(series, anomalies, filename + '_' + name, options.plotPoints)
+        return
+    _plot_diagram(g_ps_count_series, g_abnomal_data_series, filename, options.plotPoints)
     
 if __name__ == "__main__":
     helpString = (
@@ -229,6 +244,33 @@ if __name__ == "__main__":
     parser.add_option("--oswpsDir",
                       help="Path to oswpsDir. (default: %default)",
                       dest="oswpsDir", default="oswps")
+    parser.add_option("--processes", default=1, type=int,
+                      help="Worker processes used to parse oswpsDir, 0 for one per CPU. [default: %default]")
+    parser.add_option("--checkpoint",
+                      help="Checkpoint file; when set only the snapshots added to"
+                      " oswpsDir since the previous run are analysed, by the detector"
+                      " saved in --stateFile, and their scores are appended to"
+                      " --outputFile. (default: %default)",
+                      dest="checkpoint", default="")
+    parser.add_option("--stateFile", default="",
+                      help="Detector model file, resumed from when it exists and saved after"
+                      " scoring; by default the --checkpoint file with .model appended,"
+                      " for the detectors that can save their model. (default: %default)")
+    parser.add_option("--cacheDir",
+                      help="Directory caching the parsed oswpsDir files, and the zzz indexes"
+                      " of --start and --end, between runs."
+                      " (default: %default)",
+                      dest="cacheDir", default="")
+    parser.add_option("--start", default="",
+                      help="Only analyse oswpsDir snapshots from this 'YYYY-MM-DD HH:MM:SS' on. (default: %default)")
+    parser.add_option("--end", default="",
+                      help="Only analyse oswpsDir snapshots before this 'YYYY-MM-DD HH:MM:SS'. (default: %default)")
+    parser.add_option("--groupBy", default="",
+                      help="Count the oswpsDir ps lines per 'cmd', per 'user' or per group of"
+                      " this regex on the whole command line, and analyse the top series."
+                      " (default: %default)")
+    parser.add_option("--top", default=5, type=int,
+                      help="Number of --groupBy series analysed, by peak count. [default: %default]")
     parser.add_option("--outputFile",
                       help="Output file. Results will be written to this file."
                       " (default: %default)",
@@ -239,12 +281,27 @@ if __name__ == "__main__":
                       help="Minimum number for the value field. [default: %default]")
     parser.add_option("--resolution", default=None, type=float,
                       help="Resolution for the value field (overrides min and max). [default: %default]")
+    parser.add_option("--outputFormat", default="csv",
+                      help="'csv', or 'bin' for the binary columnar format of scorefile.py."
+                      " (default: %default)")
+    parser.add_option("--compress", action="store_true", default=False,
+                      help="gzip a csv output, zlib compress the columns of a bin output.")
+    parser.add_option("--rangeWindow", default=0, type=int,
+                      help="RTM only: scale errors by the value range of this many trailing points"
+                      " instead of max - min of the whole series. [default: %default]")
+    parser.add_option("--detector", default="",
+                      help="Detector to run, one of " + ", ".join(detectors.DETECTORS) +
+                      "; -r and -t pick rtm and htm. (default: %default)")
+    parser.add_option("--plotPoints", default=MAX_POINTS, type=int,
+                      help="Points of the plotted series after decimation, 0 for all;"
+                      " anomalies are always drawn. [default: %default]")
     parser.add_option("-r", action="store_true", dest="use_rtm", help="Use RTM algorithm")
     parser.add_option("-t", action="store_false", dest="use_rtm", help="Use HTM algorithm")    
     options, args = parser.parse_args(sys.argv[1:])
     
     # Run it
     runAnomaly(options)
-    plot_diagram(options)
+    if len(g_ps_count_series) or g_group_series:
+        plot_diagram(options)
   
   
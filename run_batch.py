@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from optparse import OptionParser
+import os
+import sys
+import json
+import time
+import traceback
+import multiprocessing
+
+import run_anomaly
+from csvseries import read_csv_series
+from scorefile import ScoreWriter
+
+"""
+    NAME
+      run_batch.py
+
+    DESCRIPTION
+      Run the anomaly detection of a manifest of csv files on a process pool.
+
+    NOTES
+      The manifest is a JSON list of jobs, one per input file:
+
+        [{"input": "data/rds_connections.csv",
+          "output": "anomaly_scores_rds_connections.csv",
+          "min": 0, "max": 600, "resolution": null, "detector": "htm"}]
+
+      min, max, resolution and detector default as in run_anomaly.py
+      (0, 100, from min and max, htm); rangeWindow applies to rtm, and
+      format ("csv" or "bin") and compress pick the output as the
+      --outputFormat and --compress options of run_anomaly.py do. The
+      workers import nupic and read model_params.json once and stay up
+      for all the jobs they are handed; the largest inputs are started
+      first. Each job reports its wall time and records per second.
+
+"""
+
+"""Global Variables"""
+""" Model parameters of the worker, read once by _init_worker """
+g_model_params = None
+JOB_DEFAULTS = {"min": 0.0, "max": 100.0, "resolution": None,
+                "detector": "htm", "rangeWindow": 0, "format": "csv",
+                "compress": False}
+
+
+def load_manifest(filename):
+    """Return the jobs of a manifest with their defaults filled in"""
+    with open(filename) as fp:
+        entries = json.load(fp)
+    jobs = []
+    for i, entry in enumerate(entries):
+        if "input" not in entry or "output" not in entry:
+            raise ValueError("Job %d of %s needs an input and an output" % (i, filename))
+        job = dict(JOB_DEFAULTS)
+        job.update(entry)
+        jobs.append(job)
+    return jobs
+
+
+def _init_worker(model_params_file):
+    global g_model_params
+    with open(model_params_file) as fp:
+        g_model_params = json.load(fp)
+
+
+def _run_job(job):
+    """Process pool entry point, runs one job and returns its report"""
+    report = {"input": job["input"], "output": job["output"],
+              "detector": job["detector"], "records": 0, "anomalies": 0,
+              "error": None}
+    start = time.time()
+    try:
+        series = read_csv_series(job["input"])
+        detector = run_anomaly.create_detector(job["detector"], g_model_params,
+                                               job["resolution"], job["rangeWindow"])
+        detector.fit(series, job["min"], job["max"])
+        with ScoreWriter(job["output"], binary=job["format"] == "bin",
+                         compress=job["compress"]) as writer:
+            anomalies = run_anomaly._analyze(detector, series, writer, verbose=False)
+        report["records"] = len(series)
+        report["anomalies"] = len(anomalies)
+    except Exception:
+        report["error"] = traceback.format_exc()
+    report["seconds"] = time.time() - start
+    report["records_per_second"] = report["records"] / max(report["seconds"], 1e-9)
+    return report
+
+
+def run_jobs(jobs, processes=0, model_params_file="model_params.json"):
+    """Yield the report of every job as it completes
+
+    processes is the pool size, 0 for one per CPU; 1 runs the jobs in
+    this process.
+    """
+    if not jobs:
+        return
+    order = sorted(jobs, key=lambda job: -_size(job["input"]))
+    processes = min(processes or multiprocessing.cpu_count(), len(jobs))
+    if processes == 1:
+        _init_worker(model_params_file)
+        for job in order:
+            yield _run_job(job)
+        return
+
+    pool = multiprocessing.Pool(processes, _init_worker, (model_params_file,))
+    try:
+        for report in pool.imap_unordered(_run_job, order):
+            yield report
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _size(filename):
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
+
+
+def _print_report(report):
+    if report["error"] is not None:
+        print("FAILED %s after %.2fs\n%s" % (report["input"], report["seconds"],
+                                            report["error"]))
+        return
+    print("%-40s %8d records %6d anomalies %8.2fs %10.1f records/s" % (
+        report["input"], report["records"], report["anomalies"],
+        report["seconds"], report["records_per_second"]))
+
+
+if __name__ == "__main__":
+    helpString = (
+        "\n%prog [options] manifest.json"
+        "\n%prog --help"
+        "\n"
+        "\nRuns the anomaly detection of every job of the manifest, in parallel."
+    )
+    parser = OptionParser(helpString)
+    parser.add_option("--processes", default=0, type=int,
+                      help="Worker processes, 0 for one per CPU. [default: %default]")
+    parser.add_option("--modelParams", default="model_params.json",
+                      help="Model parameters of the htm jobs. (default: %default)")
+    parser.add_option("--report", default="",
+                      help="Also write the job reports to this JSON file. (default: %default)")
+    options, args = parser.parse_args(sys.argv[1:])
+    if len(args) != 1:
+        parser.error("expected one manifest")
+
+    jobs = load_manifest(args[0])
+    start = time.time()
+    reports = []
+    for report in run_jobs(jobs, options.processes, options.modelParams):
+        _print_report(report)
+        reports.append(report)
+    elapsed = time.time() - start
+    records = sum(report["records"] for report in reports)
+    failed = sum(report["error"] is not None for report in reports)
+    print("%d jobs, %d failed, %d records in %.2fs, %.1f records/s" % (
+        len(reports), failed, records, elapsed, records / max(elapsed, 1e-9)))
+    if options.report != "":
+        with open(options.report, "w") as fp:
+            json.dump(reports, fp, indent=2)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import csv
+import gzip
+import zlib
+import struct
+import shutil
+import collections
+import numpy as np
+import pandas as pd
+
+from timeparse import epoch_to_key, keys_to_epoch
+
+"""
+    NAME
+      scorefile.py
+
+    DESCRIPTION
+      Buffered writers and readers of the anomaly score output.
+
+    NOTES
+      Scores are written either as the csv layout of run_anomaly
+
+        timestamp,value,_raw_score,likelihood_score,log_likelihood_score
+
+      or as a binary columnar file: a header with the number of rows,
+      then the int64 timestamps (epoch seconds) and the float32 value,
+      raw score, likelihood and log likelihood columns, each contiguous,
+      so read_scores() maps the columns without reading them. Rows are
+      written a block at a time; until close() the binary columns are
+      spooled to one file each next to the output.
+
+      With compression a csv file is gzipped and each binary column is
+      zlib compressed, in which case read_scores() loads the columns
+      instead of mapping them. load_scores() reads a file of either
+      layout back, e.g. to plot what incremental runs appended.
+
+"""
+
+"""Global Variables"""
+""" Columns of the csv layout """
+CSV_HEADER = ["timestamp", "value",
+              "_raw_score", "likelihood_score", "log_likelihood_score"]
+""" Rows buffered by write_one() before they are written as a block """
+BUFFER_ROWS = 1 << 14
+""" Bytes buffered by the output files """
+FILE_BUFFER = 1 << 20
+SCORES_MAGIC = b"OSWSCR"
+SCORES_VERSION = 1
+SCORES_HEADER = struct.Struct("<6sBBq")   # magic, version, compressed, rows
+SCORES_COMPRESSED = struct.Struct("<q")   # bytes of a compressed column
+SCORES_DTYPES = [np.int64, np.float32, np.float32, np.float32, np.float32]
+
+"""
+Columns of a score file, one entry per row
+
+timestamps     : int64, epoch seconds
+values         : float32 scored value
+raw_score      : float32 raw anomaly score
+likelihood     : float32 anomaly likelihood
+log_likelihood : float32 log likelihood
+"""
+ScoreColumns = collections.namedtuple(
+    'ScoreColumns',
+    ['timestamps', 'values', 'raw_score', 'likelihood', 'log_likelihood'])
+
+
+# -----------------------------------------------------------------------
+# ScoreWriter class
+
+class ScoreWriter(object):
+    """Buffered writer of scored rows
+
+    Parameters
+    ----------
+    path : string
+        output file
+
+    binary : bool, default False
+        write the binary columnar format instead of csv
+
+    compress : bool, default False
+        gzip the csv, zlib compress the binary columns
+
+    append : bool, default False
+        keep the rows of an existing output and add the new ones after
+        them; a csv file is appended to (a gzipped one gets another gzip
+        member), a binary file is rewritten with its rows first
+
+    Examples
+    --------
+    >>> with ScoreWriter('scores.bin', binary=True) as writer:
+    ...     writer.write(series.timestamps, series.values, result.raw_score,
+    ...                  result.likelihood, result.log_likelihood)
+    >>> scores = read_scores('scores.bin')
+
+    A binary file is only complete once the writer is closed; it is
+    assembled under a temporary name and renamed into place.
+    """
+
+    def __init__(self, path, binary=False, compress=False, append=False):
+        self.path = path
+        self.binary = binary
+        self.compress = compress
+        self.rows = 0
+        self.pending = [[] for _ in SCORES_DTYPES]
+        append = append and os.path.exists(path) and os.path.getsize(path) > 0
+        if binary:
+            self.spools = [open("%s.col%d" % (path, i), "wb", FILE_BUFFER)
+                           for i in range(len(SCORES_DTYPES))]
+            if append:
+                self._write_block(list(read_scores(path)))
+        else:
+            mode = "ab" if append else "wb"
+            if compress:
+                self.file = gzip.open(path, mode)
+            else:
+                self.file = open(path, mode, FILE_BUFFER)
+            self.csv = csv.writer(self.file)
+            if not append:
+                self.csv.writerow(CSV_HEADER)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write_one(self, timestamp, value, raw_score, likelihood, log_likelihood):
+        """Add one row; rows are written BUFFER_ROWS at a time"""
+        pending = self.pending
+        pending[0].append(timestamp)
+        pending[1].append(value)
+        pending[2].append(raw_score)
+        pending[3].append(likelihood)
+        pending[4].append(log_likelihood)
+        if len(pending[0]) >= BUFFER_ROWS:
+            self.flush()
+
+    def write(self, timestamps, values, raw_score, likelihood, log_likelihood):
+        """Write a block of rows, each argument an array of one column"""
+        self.flush()
+        self._write_block([timestamps, values, raw_score, likelihood, log_likelihood])
+
+    def flush(self):
+        """Write the rows added by write_one()"""
+        if self.pending[0]:
+            block = self.pending
+            self.pending = [[] for _ in SCORES_DTYPES]
+            self._write_block(block)
+
+    def _write_block(self, columns):
+        n = len(columns[0])
+        if self.binary:
+            for spool, column, dtype in zip(self.spools, columns, SCORES_DTYPES):
+                np.asarray(column, dtype=dtype).tofile(spool)
+        else:
+            lists = [np.asarray(column).tolist() for column in columns[1:]]
+            keys = [epoch_to_key(t) for t in np.asarray(columns[0], dtype=np.int64).tolist()]
+            self.csv.writerows(zip(keys, *lists))
+        self.rows += n
+
+    def close(self):
+        self.flush()
+        if not self.binary:
+            self.file.close()
+            return
+        for spool in self.spools:
+            spool.close()
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(SCORES_HEADER.pack(SCORES_MAGIC, SCORES_VERSION,
+                                       int(bool(self.compress)), self.rows))
+            for spool in self.spools:
+                with open(spool.name, "rb") as src:
+                    if self.compress:
+                        _copy_compressed(src, f)
+                    else:
+                        shutil.copyfileobj(src, f, FILE_BUFFER)
+                os.remove(spool.name)
+        os.rename(tmp, self.path)
+
+
+def _copy_compressed(src, dst):
+    """Append the zlib stream of src to dst, after its length"""
+    start = dst.tell()
+    dst.write(SCORES_COMPRESSED.pack(0))
+    compressor = zlib.compressobj()
+    while True:
+        data = src.read(FILE_BUFFER)
+        if not data:
+            break
+        dst.write(compressor.compress(data))
+    dst.write(compressor.flush())
+    end = dst.tell()
+    dst.seek(start)
+    dst.write(SCORES_COMPRESSED.pack(end - start - SCORES_COMPRESSED.size))
+    dst.seek(end)
+
+
+def read_scores(path):
+    """Return the ScoreColumns of a binary score file
+
+    The columns of an uncompressed file are read-only memory maps.
+    """
+    with open(path, "rb") as f:
+        header = f.read(SCORES_HEADER.size)
+        if len(header) < SCORES_HEADER.size:
+            raise ValueError("Not a version %d score file" % SCORES_VERSION)
+        magic, version, compressed, rows = SCORES_HEADER.unpack(header)
+        if magic != SCORES_MAGIC or version != SCORES_VERSION:
+            raise ValueError("Not a version %d score file" % SCORES_VERSION)
+        columns = []
+        if compressed:
+            for dtype in SCORES_DTYPES:
+                size, = SCORES_COMPRESSED.unpack(f.read(SCORES_COMPRESSED.size))
+                data = zlib.decompress(f.read(size))
+                columns.append(np.frombuffer(data, dtype=dtype))
+            return ScoreColumns(*columns)
+    offset = SCORES_HEADER.size
+    for dtype in SCORES_DTYPES:
+        if rows:
+            columns.append(np.memmap(path, dtype=dtype, mode="r", offset=offset,
+                                     shape=(rows,)))
+        else:
+            columns.append(np.zeros(0, dtype=dtype))
+        offset += rows * np.dtype(dtype).itemsize
+    return ScoreColumns(*columns)
+
+
+def load_scores(path):
+    """Return the ScoreColumns of a score file of either layout
+
+    A csv file, gzipped or not, is read whole; a binary one as by
+    read_scores().
+    """
+    with open(path, "rb") as f:
+        magic = f.read(len(SCORES_MAGIC))
+    if magic == SCORES_MAGIC:
+        return read_scores(path)
+    frame = pd.read_csv(path, compression="gzip" if magic.startswith(b"\x1f\x8b") else None)
+    columns = [keys_to_epoch(frame[CSV_HEADER[0]].values.astype(str))]
+    for name in CSV_HEADER[1:]:
+        columns.append(frame[name].values.astype(np.float64))
+    return ScoreColumns(*columns)
+
+
+def export_csv(path, csv_path, compress=False, block_rows=BUFFER_ROWS):
+    """Write a binary score file out in the csv layout, block by block"""
+    scores = read_scores(path)
+    with ScoreWriter(csv_path, compress=compress) as writer:
+        for i in range(0, len(scores.timestamps), block_rows):
+            block = [np.asarray(column[i:i + block_rows]) for column in scores]
+            """ float32 printed with the digits that tell it apart, not as float64 """
+            writer.write(block[0], *[np.array(["%.9g" % x for x in column.tolist()])
+                                     for column in block[1:]])
+
+
+if __name__ == "__main__":
+    from optparse import OptionParser
+    parser = OptionParser("\n%prog [options] scores.bin scores.csv"
+                          "\n\nWrites a binary score file out as csv.")
+    parser.add_option("--compress", action="store_true", default=False,
+                      help="gzip the csv file.")
+    options, args = parser.parse_args()
+    if len(args) != 2:
+        parser.error("expected a score file and a csv file")
+    export_csv(args[0], args[1], options.compress)
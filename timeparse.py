@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import datetime
+import numpy as np
+
+"""
+    NAME
+      timeparse.py
+
+    DESCRIPTION
+      Fast parsing of the fixed timestamp formats used by the osw data and
+      the input csv files, to epoch seconds.
+
+    NOTES
+      'zzz ***Mon Oct 17 09:00:41 UTC 2016'  zzz marker of an osw file
+      '2016-10-17 09:00:41'                  osw snapshot key, csv dttm column
+
+      The date part of a timestamp repeats for thousands of records, so
+      its epoch seconds are cached by the text prefix and only the time of
+      day is parsed per record. Other formats fall back to dateutil.
+
+"""
+
+"""Global Variables"""
+MONTHS = {'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+          'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12}
+
+""" Seconds east of UTC of the zone names printed by date(1) """
+TZ_OFFSETS = {
+    'UTC': 0, 'GMT': 0, 'WET': 0, 'BST': 3600, 'CET': 3600, 'CEST': 7200,
+    'EET': 7200, 'EEST': 10800, 'MSK': 10800, 'IST': 19800, 'SGT': 28800,
+    'CST': -21600, 'CDT': -18000, 'EST': -18000, 'EDT': -14400,
+    'MST': -25200, 'MDT': -21600, 'PST': -28800, 'PDT': -25200,
+    'JST': 32400, 'KST': 32400, 'AEST': 36000, 'AEDT': 39600,
+}
+
+""" Number of date prefixes kept before the cache is reset """
+CACHE_SIZE = 100000
+""" Positions of the separators and digits of a 'YYYY-MM-DD HH:MM:SS' key """
+_KEY_DASHES = [4, 7]
+_KEY_COLONS = [13, 16]
+_KEY_DIGITS = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]
+
+_day_cache = {}
+
+
+def _days_from_civil(y, m, d):
+    """Days since 1970-01-01 of a proleptic Gregorian date
+
+    Works on ints and on numpy integer arrays alike.
+    """
+    y = y - (m <= 2)
+    era = y // 400
+    yoe = y - era * 400
+    mp = (m + 9) % 12
+    doy = (153 * mp + 2) // 5 + d - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def _cache_day(key, seconds):
+    if len(_day_cache) >= CACHE_SIZE:
+        _day_cache.clear()
+    _day_cache[key] = seconds
+    return seconds
+
+
+def key_to_epoch(key, utc_offset=0):
+    """'2016-10-17 09:00:41' -> epoch seconds
+
+    Parameters
+    ----------
+    key : string
+        'YYYY-MM-DD HH:MM:SS', a 'T' separator and a fractional part
+        ('.000000', dropped) are accepted too
+
+    utc_offset : int, default 0
+        seconds east of UTC of the clock the timestamp was taken on
+    """
+    date = key[:10]
+    day = _day_cache.get(date)
+    if day is None:
+        if len(key) < 19 or key[4] != '-' or key[7] != '-':
+            raise ValueError("Not a 'YYYY-MM-DD HH:MM:SS' timestamp: " + key)
+        day = _cache_day(date, 86400 * _days_from_civil(
+            int(key[0:4]), int(key[5:7]), int(key[8:10])))
+    return (day + 3600 * int(key[11:13]) + 60 * int(key[14:16]) +
+            int(key[17:19]) - utc_offset)
+
+
+def zzz_to_epoch(zzz, utc_offset=None):
+    """'zzz ***Mon Oct 17 09:00:41 UTC 2016' -> epoch seconds
+
+    Parameters
+    ----------
+    zzz : string
+        zzz marker line starting at 'zzz'
+
+    utc_offset : int, default None
+        seconds east of UTC; by default taken from the zone name in the
+        marker, and 0 for unknown zone names
+    """
+    prefix = (zzz[11:17], zzz[27:].strip(), utc_offset)
+    day = _day_cache.get(prefix)
+    if day is None:
+        fields = zzz[7:].split()
+        if len(fields) < 6:
+            raise ValueError("Not a zzz marker: " + zzz)
+        try:
+            month = MONTHS[fields[1][:3].lower()]
+        except KeyError:
+            raise ValueError("Not a month " + fields[1])
+        if utc_offset is None:
+            utc_offset = TZ_OFFSETS.get(fields[4].upper(), 0)
+        day = _cache_day(prefix, 86400 * _days_from_civil(
+            int(fields[5]), month, int(fields[2])) - utc_offset)
+    return (day + 3600 * int(zzz[18:20]) + 60 * int(zzz[21:23]) +
+            int(zzz[24:26]))
+
+
+def epoch_to_key(epoch):
+    """epoch seconds -> '2016-10-17 09:00:41', the inverse of key_to_epoch"""
+    days, seconds = divmod(int(epoch), 86400)
+    date = _day_cache.get(days)
+    if date is None:
+        date = _cache_day(days, (datetime.date(1970, 1, 1) +
+                                 datetime.timedelta(days)).isoformat())
+    return '%s %02d:%02d:%02d' % (date, seconds // 3600,
+                                  seconds // 60 % 60, seconds % 60)
+
+
+def parse_datetime(text):
+    """Return a naive datetime, fast for 'YYYY-MM-DD HH:MM:SS' text
+
+    Any other layout (e.g. '25/2/2014 6:45') goes through dateutil.
+    """
+    if len(text) >= 19 and text[4] == '-' and text[7] == '-' and \
+            text[10] in ' T' and text[13] == ':' and text[16] == ':':
+        return datetime.datetime(int(text[0:4]), int(text[5:7]),
+                                 int(text[8:10]), int(text[11:13]),
+                                 int(text[14:16]), int(text[17:19]))
+    import dateutil.parser
+    return dateutil.parser.parse(text)
+
+
+def keys_to_epoch(keys, utc_offset=0):
+    """Vectorized key_to_epoch
+
+    Parameters
+    ----------
+    keys : sequence or array of 'YYYY-MM-DD HH:MM:SS' strings
+
+    Returns
+    -------
+    epoch : int64 ndarray
+
+    Like key_to_epoch a 'T' separator and a fractional part are accepted;
+    any other key raises ValueError instead of giving a wrong epoch.
+    """
+    raw = np.asarray(keys).ravel()
+    if raw.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    if raw.dtype.kind not in ('S', 'U'):
+        raise ValueError("Timestamps are not 'YYYY-MM-DD HH:MM:SS' strings")
+    lengths = np.char.str_len(raw)
+    grid = raw.astype('S20').view(np.uint8).reshape(-1, 20)
+    chars = grid[:, _KEY_DIGITS]
+    bad = ((lengths < 19) | ((lengths > 19) & (grid[:, 19] != ord('.'))) |
+           np.any(grid[:, _KEY_DASHES] != ord('-'), axis=1) |
+           np.any(grid[:, _KEY_COLONS] != ord(':'), axis=1) |
+           ((grid[:, 10] != ord(' ')) & (grid[:, 10] != ord('T'))) |
+           np.any((chars < ord('0')) | (chars > ord('9')), axis=1))
+    if bad.any():
+        raise ValueError("Not a 'YYYY-MM-DD HH:MM:SS' timestamp: %r"
+                         % (raw[np.argmax(bad)].item(),))
+    digits = grid[:, :19].astype(np.int64) - ord('0')
+
+    def field(start, stop):
+        value = np.zeros(len(digits), dtype=np.int64)
+        for i in range(start, stop):
+            value = value * 10 + digits[:, i]
+        return value
+
+    days = _days_from_civil(field(0, 4), field(5, 7), field(8, 10))
+    return (86400 * days + 3600 * field(11, 13) + 60 * field(14, 16) +
+            field(17, 19) - utc_offset)
+
+
+def keys_to_datetime64(keys, utc_offset=0):
+    """Vectorized key parsing to a datetime64[s] array (UTC)"""
+    return keys_to_epoch(keys, utc_offset).astype('datetime64[s]')
+
+
+def zzz_to_datetime64(zzz_lines, utc_offset=None):
+    """Parse many zzz markers to a datetime64[s] array (UTC)"""
+    epoch = np.fromiter((zzz_to_epoch(z, utc_offset) for z in zzz_lines),
+                        dtype=np.int64)
+    return epoch.astype('datetime64[s]')
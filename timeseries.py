@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from timeparse import keys_to_epoch, epoch_to_key
+
+"""
+    NAME
+      timeseries.py
+
+    DESCRIPTION
+      Time series backed by numpy arrays, sorted by timestamp unless
+      built with sort=False.
+
+    NOTES
+      Replaces the {'YYYY-MM-DD HH:MM:SS': value} dicts that had to be
+      sorted again by every consumer. Timestamps are int64 epoch seconds
+      of the printed wall clock, see timeparse.key_to_epoch.
+
+"""
+
+
+# -----------------------------------------------------------------------
+# TimeSeries class
+
+class TimeSeries(object):
+    """Time series kept sorted by timestamp
+
+    Parameters
+    ----------
+    timestamps : sequence of int, default None
+        epoch seconds
+
+    values : sequence of number, default None
+        one value per timestamp
+
+    sort : bool, default True
+        sort unsorted input by timestamp; False keeps the points in the
+        order given, e.g. the row order of a csv file, and only slice()
+        then refuses an unsorted series
+
+    Examples
+    --------
+    >>> ts = osw.get_ps_series()
+    >>> ts.slice(key_to_epoch('2016-10-17 10:00:00'), None)
+    >>> for timestamp, value in ts:
+    ...     rtm.push_refactor(timestamp, value)
+
+    Unsorted input is sorted once on construction; append() only accepts
+    timestamps at or after the last one, so the series never needs to be
+    sorted again.
+    """
+
+    def __init__(self, timestamps=None, values=None, sort=True):
+        if timestamps is None:
+            timestamps = []
+        if values is None:
+            values = []
+        timestamps = np.array(timestamps, dtype=np.int64)
+        values = np.array(values, dtype=np.float64)
+        if timestamps.shape != values.shape or timestamps.ndim != 1:
+            raise ValueError("timestamps and values must be 1-D of one length")
+        self.is_sorted = not (len(timestamps) > 1 and
+                              np.any(timestamps[1:] < timestamps[:-1]))
+        if sort and not self.is_sorted:
+            order = np.argsort(timestamps, kind='mergesort')
+            timestamps = timestamps[order]
+            values = values[order]
+            self.is_sorted = True
+        self._timestamps = timestamps
+        self._values = values
+        self._n = len(timestamps)
+
+    @classmethod
+    def from_dict(cls, d):
+        """Build from a {'YYYY-MM-DD HH:MM:SS': value} dict"""
+        keys = list(d.keys())
+        return cls(keys_to_epoch(keys), [d[k] for k in keys])
+
+    @property
+    def timestamps(self):
+        return self._timestamps[:self._n]
+
+    @property
+    def values(self):
+        return self._values[:self._n]
+
+    def __len__(self):
+        return self._n
+
+    def __iter__(self):
+        return iter(zip(self.timestamps.tolist(), self.values.tolist()))
+
+    def append(self, timestamp, value):
+        """Add one point at or after the last timestamp"""
+        if self._n and timestamp < self._timestamps[self._n - 1]:
+            raise ValueError("append() out of order: %s" % timestamp)
+        if self._n == len(self._timestamps):
+            capacity = max(16, 2 * self._n)
+            self._timestamps = np.resize(self._timestamps, capacity)
+            self._values = np.resize(self._values, capacity)
+        self._timestamps[self._n] = timestamp
+        self._values[self._n] = value
+        self._n += 1
+
+    def slice(self, start=None, end=None):
+        """Return the points with start <= timestamp < end
+
+        None leaves that side open. The result shares no memory with this
+        series.
+        """
+        if not self.is_sorted:
+            raise ValueError("slice() of a series that is not sorted by timestamp")
+        ts = self.timestamps
+        i = 0 if start is None else np.searchsorted(ts, start, 'left')
+        j = self._n if end is None else np.searchsorted(ts, end, 'left')
+        return TimeSeries(ts[i:j], self.values[i:j])
+
+    def merge(self, other):
+        """Return the union of two series; other wins on equal timestamps"""
+        ts = np.concatenate([self.timestamps, other.timestamps])
+        vs = np.concatenate([self.values, other.values])
+        order = np.argsort(ts, kind='mergesort')
+        ts = ts[order]
+        vs = vs[order]
+        if len(ts) > 1:
+            """ Keep the last of each run of equal timestamps """
+            keep = np.ones(len(ts), dtype=bool)
+            keep[:-1] = ts[1:] != ts[:-1]
+            ts = ts[keep]
+            vs = vs[keep]
+        return TimeSeries(ts, vs)
+
+    def keys(self):
+        """Timestamps as 'YYYY-MM-DD HH:MM:SS' strings"""
+        return [epoch_to_key(t) for t in self.timestamps.tolist()]
+
+    def to_dict(self):
+        return dict(zip(self.keys(), self.values.tolist()))
+
+    def min(self):
+        return self.values.min()
+
+    def max(self):
+        return self.values.max()